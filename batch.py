@@ -0,0 +1,96 @@
+import gc
+import json
+import multiprocessing
+import statistics
+import time
+from consts import RESULTS_PAGE_SIZE
+
+# Set in the parent just before the pool forks, so every worker inherits the
+# loaded index instead of opening its own copy.
+_runner = None
+
+
+def _evaluate(query):
+    return _runner.evaluate(query)
+
+
+def read_queries(file):
+    for line in file:
+        query = line.strip()
+        if query:
+            yield query
+
+
+def latency_summary(latencies):
+    if len(latencies) < 2:
+        latency = latencies[0] if latencies else 0.0
+        return {"p50_ms": latency, "p95_ms": latency, "p99_ms": latency}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {"p50_ms": cuts[49], "p95_ms": cuts[94], "p99_ms": cuts[98]}
+
+
+# Runs queries without any prompts and writes one JSON object per query, in
+# input order: its ranked (page, score) results, optionally with snippets,
+# and how long it took. Queries that fail to parse get an "error" instead.
+class BatchRunner:
+    def __init__(self, search_engine, size=RESULTS_PAGE_SIZE, snippets=False):
+        self.search_engine = search_engine
+        self.size = size
+        self.snippets = snippets
+
+    def evaluate(self, query):
+        start = time.perf_counter()
+        record = {"query": query}
+        missing = []
+        try:
+            entries, more = self.search_engine.results_page(query, 1, self.size, snippets=self.snippets, missing=missing)
+        except RuntimeError as e:
+            record["error"] = str(e)
+        else:
+            results = []
+            for page_num, score, snippet in entries:
+                result = {"page": page_num, "label": self.search_engine.page_label(page_num), "score": score}
+                if snippet is not None:
+                    result["snippet"] = snippet.text
+                    result["highlights"] = snippet.highlights
+                results.append(result)
+            record["results"] = results
+            record["more"] = more
+            if missing:
+                record["missing_shards"] = missing
+        record["ms"] = (time.perf_counter() - start) * 1000
+        return record
+
+    def run(self, queries, output, workers=1):
+        global _runner
+        start = time.perf_counter()
+        latencies = []
+        errors = 0
+        pool = None
+        if workers > 1:
+            _runner = self
+            gc.freeze()
+            pool = multiprocessing.get_context("fork").Pool(workers)
+            records = pool.imap(_evaluate, queries, chunksize=8)
+        else:
+            records = map(self.evaluate, queries)
+        try:
+            for record in records:
+                output.write(json.dumps(record) + "\n")
+                latencies.append(record["ms"])
+                errors += "error" in record
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+                gc.unfreeze()
+                _runner = None
+        elapsed = time.perf_counter() - start
+        return {
+            "queries": len(latencies),
+            "errors": errors,
+            "workers": workers,
+            "seconds": elapsed,
+            "queries_per_second": len(latencies) / elapsed if elapsed else 0.0,
+            **latency_summary(latencies),
+        }
@@ -0,0 +1,268 @@
+import argparse
+import gc
+import json
+import os
+import pickle
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from consts import INDEX_DIR, PAGES_FILE, DOCUMENT, BUILD_MEMORY
+from trie import Trie
+from disk_index import write_index, load_index
+from page_text import PageTextStore
+from pdf_parser import PDFParser, split_words
+from search_engine import SearchEngine
+from snapshots import current_snapshot
+
+# Results `--baseline` compares against by default. Timings depend on the
+# machine, so regenerate it where the benchmarks run with
+# `python benchmark.py queries trie --json benchmark_baseline.json`.
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+WORKLOAD = {
+    "term": ["heap", "tree", "python", "algorithm", "recursion", "hash", "graph", "sorting"],
+    "boolean": ["heap AND priority", "binary OR tree", "tree NOT binary", "(merge OR quick) AND sort", "list AND NOT linked", "stack OR queue OR deque"],
+    "phrase": ['"priority queue"', '"binary search tree"', '"divide and conquer"', '"dynamic programming"', '"linked list"'],
+    "wildcard": ["radi*", "qu*", "*sort", "heap*fy", "*tion"],
+    "misspelling": ["prioritty", "algoritm", "pyhton", "strukture", "recusion", "grpah"],
+}
+
+
+def load_postings(pages_path=None):
+    text = PageTextStore(pages_path or os.path.join(current_snapshot() or INDEX_DIR, PAGES_FILE))
+    postings = {}
+    for page, page_text in text.items():
+        for position, word in enumerate(split_words(page_text)):
+            postings.setdefault(word, []).append((page, position))
+    text.close()
+    return postings
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def timed(function, arguments, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for argument in arguments:
+            function(argument)
+        best = min(best, time.perf_counter() - start)
+    return best / max(len(arguments), 1)
+
+
+def build_trie(postings):
+    trie = Trie()
+    for word, word_postings in postings.items():
+        trie.extend(word, word_postings)
+    return trie
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+# The on-disk index the engine searches, against the pickled Trie it
+# replaced. Memory is what opening each dictionary allocates on the Python
+# heap; the index's mapped files are paged in by the OS as they are read.
+def benchmark_trie(postings):
+    words = sorted(postings)
+    prefixes = sorted({word[:2] for word in words})
+    missing = [word + "#" for word in words]
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="search-engine-benchmark-") as scratch:
+        trie_path = os.path.join(scratch, "library")
+        with open(trie_path, "wb") as file:
+            pickle.dump(build_trie(postings), file)
+
+        def load_trie():
+            with open(trie_path, "rb") as file:
+                return pickle.load(file)
+
+        trie, memory_bytes, load_seconds = measure(load_trie)
+        results["Trie"] = {
+            "words": len(words),
+            "disk_bytes": os.path.getsize(trie_path),
+            "memory_bytes": memory_bytes,
+            "load_seconds": load_seconds,
+            "search_us": timed(trie.search, words) * 1e6,
+            "miss_us": timed(trie.search, missing) * 1e6,
+            "prefix_us": timed(trie.starts_with, prefixes) * 1e6,
+        }
+        del trie
+
+        index_path = os.path.join(scratch, "index")
+        write_index(index_path, postings.items())
+        index, memory_bytes, load_seconds = measure(lambda: load_index(index_path))
+        results["DiskIndex"] = {
+            "words": len(index),
+            "disk_bytes": directory_bytes(index_path),
+            "memory_bytes": memory_bytes,
+            "load_seconds": load_seconds,
+            "search_us": timed(index.search, words) * 1e6,
+            "miss_us": timed(index.search, missing) * 1e6,
+            "prefix_us": timed(lambda prefix: index.expand(prefix + "*", limit=None), prefixes) * 1e6,
+        }
+        index.close()
+    return results
+
+
+def print_trie(results):
+    print(f"{'':<10}{'disk':>12}{'memory':>12}{'load':>10}{'search':>10}{'miss':>10}{'prefix':>10}")
+    for name, result in results.items():
+        print(f"{name:<10}{result['disk_bytes'] / 2 ** 20:>10.1f}MB{result['memory_bytes'] / 2 ** 20:>10.1f}MB"
+              f"{result['load_seconds'] * 1000:>8.1f}ms{result['search_us']:>8.2f}us{result['miss_us']:>8.2f}us{result['prefix_us']:>8.1f}us")
+
+
+def peak_rss_kb():
+    return {
+        "self_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def benchmark_index(document, workers, memory_budget=BUILD_MEMORY):
+    start = time.perf_counter()
+    parser = PDFParser(document, workers=workers, rebuild=True, memory_budget=memory_budget)
+    elapsed = time.perf_counter() - start
+    pages = parser.document.page_count
+    peak_rss = peak_rss_kb()
+    start = time.perf_counter()
+    parser = PDFParser(document, workers=workers)
+    return parser, {
+        "pages": pages,
+        "workers": workers,
+        "memory_budget": memory_budget,
+        "build_seconds": elapsed,
+        "pages_per_second": pages / elapsed,
+        "startup_seconds": time.perf_counter() - start,
+        "peak_rss": peak_rss,
+    }
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50_ms": cuts[49], "p95_ms": cuts[94], "p99_ms": cuts[98], "runs": len(samples)}
+
+
+# Every query runs against cold caches so the numbers measure the index and
+# not the result cache; misspellings go through the did-you-mean path.
+def benchmark_queries(parser, repeat):
+    search_engine = SearchEngine(parser.trie, parser.text, parser.page_rank, parser.spans, report=False)
+    results = {}
+    for query_class, queries in WORKLOAD.items():
+        samples = []
+        for _ in range(repeat):
+            for query in queries:
+                search_engine.cache.clear()
+                start = time.perf_counter()
+                if query_class == "misspelling":
+                    parser.did_you_mean(query)
+                else:
+                    search_engine.results_page(query)
+                samples.append((time.perf_counter() - start) * 1000)
+        results[query_class] = percentiles(samples)
+    search_engine.close()
+    return results
+
+
+def print_queries(results):
+    print(f"{'':<12}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for query_class, result in results.items():
+        print(f"{query_class:<12}{result['p50_ms']:>8.2f}ms{result['p95_ms']:>8.2f}ms{result['p99_ms']:>8.2f}ms")
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+# Metrics are compared by their unit: rates must not drop and times or sizes
+# must not grow by more than `threshold` (a fraction) against the baseline.
+def compare(results, baseline, threshold):
+    baseline = dict(flatten(baseline))
+    regressions = []
+    for key, value in flatten(results):
+        if key not in baseline or not isinstance(value, (int, float)):
+            continue
+        expected = baseline[key]
+        if key.endswith("_per_second"):
+            regressed = value < expected * (1 - threshold)
+        elif key.endswith(("_ms", "_us", "_seconds", "_bytes", "_kb")):
+            regressed = value > expected * (1 + threshold)
+        else:
+            continue
+        if regressed:
+            regressions.append(f"{key}: {value:.4g} (baseline {expected:.4g})")
+    return regressions
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Benchmarks for the search engine.")
+    arguments.add_argument("suites", nargs="*", metavar="{index,queries,trie}", help="benchmarks to run (default: all)")
+    arguments.add_argument("--document", default=DOCUMENT, help="PDF to index")
+    arguments.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of processes used to build the index")
+    arguments.add_argument("--memory", type=int, default=BUILD_MEMORY // 2 ** 20, metavar="MB", help="memory budget for postings while indexing")
+    arguments.add_argument("--repeat", type=int, default=20, help="how many times the query workload is replayed")
+    arguments.add_argument("--text", help="page text store to build the dictionary benchmark from (default: the current index snapshot's)")
+    arguments.add_argument("--json", metavar="PATH", help="write the results as JSON")
+    arguments.add_argument("--baseline", metavar="PATH", default=BASELINE if os.path.exists(BASELINE) else None,
+                           help="JSON results to compare against (default: benchmark_baseline.json next to this script; "
+                                "regenerate it on the benchmark machine with --json, or pass an empty PATH to skip the comparison)")
+    arguments.add_argument("--threshold", type=float, default=0.2, help="allowed regression against the baseline, as a fraction")
+    args = arguments.parse_args()
+    suites = args.suites or ["index", "queries", "trie"]
+    for suite in suites:
+        if suite not in ("index", "queries", "trie"):
+            arguments.error(f"unknown benchmark {suite}")
+
+    results = {}
+    document = os.path.abspath(args.document)
+    text_path = os.path.abspath(args.text or os.path.join(current_snapshot() or INDEX_DIR, PAGES_FILE))
+    json_path = args.json and os.path.abspath(args.json)
+    baseline_path = args.baseline and os.path.abspath(args.baseline)
+    parser = None
+    original_directory = os.getcwd()
+    # The index benchmark builds in a scratch directory that is removed
+    # afterwards; the query benchmark then runs against that fresh build.
+    with tempfile.TemporaryDirectory(prefix="search-engine-benchmark-") as scratch:
+        try:
+            if "index" in suites:
+                os.chdir(scratch)
+                parser, results["index"] = benchmark_index(document, args.workers, args.memory * 2 ** 20)
+                print(f"Indexed {results['index']['pages']} pages at {results['index']['pages_per_second']:.1f} pages/s, peak RSS {results['index']['peak_rss']['self_kb'] / 1024:.0f} MB, reopened in {results['index']['startup_seconds'] * 1000:.0f} ms")
+            if "queries" in suites:
+                if parser is None:
+                    parser = PDFParser(document, workers=args.workers)
+                results["queries"] = benchmark_queries(parser, args.repeat)
+                print_queries(results["queries"])
+        finally:
+            os.chdir(original_directory)
+    if "trie" in suites:
+        results["trie"] = benchmark_trie(load_postings(text_path))
+        print_trie(results["trie"])
+
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(results, file, indent=2)
+    if baseline_path:
+        with open(baseline_path) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,59 @@
+from array import array
+from difflib import SequenceMatcher
+from snippets import WORD
+from page_store import PageStore, write_page_store
+
+
+# Rectangle of every word on a page, in the same order as the word positions
+# in the postings: word p is boxes[4 * p:4 * p + 4] as x0, y0, x1, y1 float32.
+# fitz splits words on whitespace only, so a word such as "heap-based" is cut
+# into its \w+ parts, each getting its share of the width. Words fitz reports
+# differently from the page text are aligned by sequence and left as empty
+# rectangles if they cannot be matched.
+def word_boxes(page, text, spans):
+    words = [text[spans[i]:spans[i + 1]].lower() for i in range(0, len(spans), 2)]
+    extracted = []
+    rectangles = []
+    for x0, y0, x1, y1, word, *_ in page.get_text("words"):
+        width = (x1 - x0) / max(len(word), 1)
+        for match in WORD.finditer(word):
+            extracted.append(match.group().lower())
+            rectangles.append((x0 + width * match.start(), y0, x0 + width * match.end(), y1))
+
+    boxes = array("f", bytes(16 * len(words)))
+    if extracted == words:
+        blocks = [(0, 0, len(words))]
+    else:
+        blocks = SequenceMatcher(None, words, extracted, autojunk=False).get_matching_blocks()
+    for position, extracted_position, size in blocks:
+        for i in range(size):
+            boxes[4 * (position + i):4 * (position + i + 1)] = array("f", rectangles[extracted_position + i])
+    return boxes
+
+
+def write_boxes(path, document, text, spans):
+    write_page_store(path, ((page, word_boxes(document[page], page_text, spans[page]).tobytes()) for page, page_text in text.items()))
+
+
+class BoxStore:
+    def __init__(self, path):
+        self.store = PageStore(path)
+
+    def close(self):
+        self.store.close()
+
+    def __contains__(self, page):
+        return page in self.store
+
+    def __getitem__(self, page):
+        return array("f", self.store[page])
+
+    def rectangles(self, page, hits):
+        boxes = self[page]
+        rectangles = []
+        for position, length in hits:
+            for word in range(position, position + length):
+                box = tuple(boxes[4 * word:4 * word + 4])
+                if len(box) == 4 and box[2] > box[0]:
+                    rectangles.append(box)
+        return rectangles
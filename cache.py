@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+from consts import CACHE_ENTRIES, CACHE_BYTES
+
+
+class LRUCache:
+    def __init__(self, max_entries=CACHE_ENTRIES, max_bytes=CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=1):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class QueryCache:
+    def __init__(self, version=None, max_entries=CACHE_ENTRIES, max_bytes=CACHE_BYTES):
+        self.version = version
+        self.current_version = version() if version is not None else None
+        self.results = LRUCache(max_entries, max_bytes)
+        self.postings = LRUCache(max_entries, max_bytes)
+        self.snippets = LRUCache(max_entries, max_bytes)
+        self.invalidations = 0
+
+    def caches(self):
+        return {"results": self.results, "postings": self.postings, "snippets": self.snippets}
+
+    # Clears every cache if the index changed since the last call; returns
+    # whether it did.
+    def validate(self):
+        if self.version is None:
+            return False
+        version = self.version()
+        if version == self.current_version:
+            return False
+        self.clear()
+        self.current_version = version
+        self.invalidations += 1
+        return True
+
+    def clear(self):
+        for cache in self.caches().values():
+            cache.clear()
+
+    def stats(self):
+        stats = {name: cache.stats() for name, cache in self.caches().items()}
+        stats["invalidations"] = self.invalidations
+        return stats
+
+    def __str__(self):
+        parts = [f"{name} {cache.hits}/{cache.hits + cache.misses} hits" for name, cache in self.caches().items()]
+        return f"Cache: {', '.join(parts)}, {self.invalidations} invalidation(s)"
@@ -1,12 +1,38 @@
 TRIE_PATH = "library"
 TEXT_PATH = "text"
 DICTIONARY = "dictionary"
+DOCUMENT = "Data Structures and Algorithms in Python.pdf"
 RESULTS = "search_results.pdf"
+EXPORT = "highlighted.pdf"
+
+INDEX_DIR = "index"
+TERMS_FILE = "terms.bin"
+OFFSETS_FILE = "offsets.bin"
+POSTINGS_FILE = "postings.bin"
+SPELLING_FILE = "spelling.bin"
+PAGE_RANK_FILE = "page_rank.bin"
+STATS_FILE = "stats.bin"
+SPANS_FILE = "spans.bin"
+BOXES_FILE = "boxes.bin"
+PERMUTERM_FILE = "permuterm.bin"
+PAGES_FILE = "pages.bin"
+CURRENT_FILE = "CURRENT"
+SNAPSHOTS_KEPT = 2
+RELOAD_INTERVAL = 1.0
+
+CORPUS_DIR = "corpus"
+MANIFEST = "manifest.json"
+PAGE_BITS = 16
+MERGE_THRESHOLD = 8
+INDEX_CHUNK_PAGES = 64
+BUILD_MEMORY = 64 * 1024 * 1024
 
 expression_priority = {
     "AND": 2,
     "OR": 1,
-    "NOT": 3
+    "NOT": 3,
+    "NEAR": 4,
+    "ONEAR": 4
 }
 
 def calculate_priority(expression):
@@ -15,4 +41,24 @@ def calculate_priority(expression):
 GREEN = "\033[32m"
 ORANGE = "\033[38;2;255;165;0m"
 LIGHT_BLUE = "\033[94m"
-RESET = "\033[0m"
\ No newline at end of file
+RESET = "\033[0m"
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+PAGE_RANK_WEIGHT = 1.0
+PROXIMITY_WEIGHT = 1.0
+RESULTS_PAGE_SIZE = 10
+CACHE_ENTRIES = 1024
+CACHE_BYTES = 64 * 1024 * 1024
+PAGE_TEXT_CACHE = 64
+SNIPPET_CONTEXT = 30
+WILDCARD_EXPANSIONS = 64
+REPORT_QUEUE_SIZE = 1
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8080
+REQUEST_TIMEOUT = 5.0
+MAX_PAGE_SIZE = 100
+
+SHARDS_DIR = "shards"
+SHARD_TIMEOUT = 2.0
\ No newline at end of file
@@ -0,0 +1,298 @@
+import fitz
+import heapq
+import json
+import os
+import shutil
+import threading
+from collections import defaultdict
+from itertools import groupby
+from consts import *
+from disk_index import write_index, load_index
+from postings import PostingList
+from page_rank import PageRank
+from pdf_parser import partial_indexes, cross_references, did_you_mean
+from spelling import SpellingIndex
+from snippets import write_spans, load_spans
+from page_text import write_page_text, convert_page_text, PageTextStore
+
+
+def page_id(doc_id, page):
+    return (doc_id << PAGE_BITS) | page
+
+
+def locate(page_id):
+    return page_id >> PAGE_BITS, page_id & ((1 << PAGE_BITS) - 1)
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        self.index = load_index(path)
+        pages_path = os.path.join(path, PAGES_FILE)
+        if not os.path.exists(pages_path):
+            convert_page_text(os.path.join(path, TEXT_PATH), pages_path)
+        self.text = PageTextStore(pages_path)
+        self.graph = PageRank.load(os.path.join(path, PAGE_RANK_FILE))
+        self.spans = load_spans(os.path.join(path, SPANS_FILE), self.text)
+
+    @staticmethod
+    def write(path, items, text, spans, graph):
+        write_index(path, items)
+        write_spans(os.path.join(path, SPANS_FILE), spans)
+        write_page_text(os.path.join(path, PAGES_FILE), text)
+        graph.save(os.path.join(path, PAGE_RANK_FILE))
+        return Segment(path)
+
+
+class CorpusText:
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def __getitem__(self, page_id):
+        for segment in list(self.corpus.segments.values()):
+            if page_id in segment.text:
+                return segment.text[page_id]
+        raise KeyError(page_id)
+
+    def __len__(self):
+        return sum(len(segment.text) for segment in list(self.corpus.segments.values()))
+
+    def label(self, page_id):
+        doc_id, page = locate(page_id)
+        document = self.corpus.manifest["documents"].get(str(doc_id))
+        if document is None:
+            return str(page_id)
+        return f"{os.path.basename(document['path'])}, {page}"
+
+
+class CorpusSpans:
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def __getitem__(self, page_id):
+        for segment in list(self.corpus.segments.values()):
+            if page_id in segment.spans:
+                return segment.spans[page_id]
+        raise KeyError(page_id)
+
+
+class Corpus:
+    def __init__(self, path=CORPUS_DIR):
+        self.path = path
+        self.lock = threading.RLock()
+        self.merge_lock = threading.Lock()
+        self.merge_thread = None
+        self.segments = {}
+        self.text = CorpusText(self)
+        self.spans = CorpusSpans(self)
+        self._load_manifest()
+
+    def _manifest_version(self):
+        manifest_path = os.path.join(self.path, MANIFEST)
+        if not os.path.exists(manifest_path):
+            return None
+        stat = os.stat(manifest_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    # Reads the manifest and opens the segments it lists that are not open
+    # yet. Segment names are never reused, so open ones are kept as they are.
+    def _load_manifest(self):
+        self.manifest_version = self._manifest_version()
+        self.manifest = {"next_doc_id": 0, "next_segment": 0, "segments": [], "documents": {}, "tombstones": {}}
+        manifest_path = os.path.join(self.path, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                self.manifest = json.load(file)
+        self.segments = {name: self.segments.get(name) or Segment(os.path.join(self.path, name)) for name in self.manifest["segments"]}
+        self.spelling = None
+        self.deleted_pages = self._deleted_pages()
+        self.page_rank = self.generate_graph()
+
+    # The version of the manifest in use. A manifest changed by another
+    # process (adding, removing or merging documents) is loaded first, so the
+    # query cache validated against this sees the change.
+    def version(self):
+        with self.lock:
+            if self._manifest_version() != self.manifest_version:
+                self._load_manifest()
+            return self.manifest_version
+
+    def _save_manifest(self):
+        os.makedirs(self.path, exist_ok=True)
+        manifest_path = os.path.join(self.path, MANIFEST)
+        with open(manifest_path + ".tmp", "w") as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        self.manifest_version = self._manifest_version()
+
+    def _deleted_pages(self):
+        tombstones = self.manifest["tombstones"]
+        return PostingList.from_items(
+            (page_id(int(doc_id), page), [])
+            for doc_id in sorted(tombstones, key=int)
+            for page in range(tombstones[doc_id]["pages"])
+        )
+
+    def _new_segment_name(self):
+        name = f"segment_{self.manifest['next_segment']}"
+        self.manifest["next_segment"] += 1
+        return name
+
+    def add_document(self, document_path, workers=1):
+        document = fitz.open(document_path)
+        if document.page_count >= 1 << PAGE_BITS:
+            raise ValueError(f"{document_path} has more than {(1 << PAGE_BITS) - 1} pages.")
+        with self.lock:
+            doc_id = self.manifest["next_doc_id"]
+            self.manifest["next_doc_id"] += 1
+            name = self._new_segment_name()
+        text = {}
+        spans = {}
+        postings = defaultdict(list)
+        graph = PageRank()
+        try:
+            for part_text, part_postings, part_spans in partial_indexes(document, document_path, workers):
+                for page, page_text in part_text.items():
+                    text[page_id(doc_id, page)] = page_text
+                    spans[page_id(doc_id, page)] = part_spans[page]
+                for word, word_postings in part_postings.items():
+                    postings[word].extend((page_id(doc_id, page), position) for page, position in word_postings)
+            page_count = document.page_count
+        finally:
+            document.close()
+        for page in range(page_count):
+            for destination_page in cross_references(text[page_id(doc_id, page)], page_count):
+                graph.add_edge(page_id(doc_id, page), page_id(doc_id, destination_page))
+        segment = Segment.write(os.path.join(self.path, name), postings.items(), text, spans, graph)
+        with self.lock:
+            self.manifest["documents"][str(doc_id)] = {"path": document_path, "segment": name, "pages": page_count}
+            self.manifest["segments"].append(name)
+            self._save_manifest()
+            self.segments = {**self.segments, name: segment}
+            self.spelling = None
+            self.page_rank = self.generate_graph()
+        self.maybe_merge()
+        return doc_id
+
+    def remove_document(self, doc_id):
+        with self.lock:
+            document = self.manifest["documents"].pop(str(doc_id), None)
+            if document is None:
+                raise KeyError(f"Document {doc_id} is not in the corpus.")
+            self.manifest["tombstones"][str(doc_id)] = {"segment": document["segment"], "pages": document["pages"]}
+            self._save_manifest()
+            self.deleted_pages = self._deleted_pages()
+            self.page_rank = self.generate_graph()
+
+    def documents(self):
+        return {int(doc_id): document for doc_id, document in self.manifest["documents"].items()}
+
+    def maybe_merge(self):
+        if len(self.segments) >= MERGE_THRESHOLD:
+            self.start_merge()
+
+    def start_merge(self):
+        if self.merge_thread is not None and self.merge_thread.is_alive():
+            return self.merge_thread
+        self.merge_thread = threading.Thread(target=self.merge_segments, daemon=True)
+        self.merge_thread.start()
+        return self.merge_thread
+
+    def merge_segments(self):
+        with self.merge_lock:
+            with self.lock:
+                names = list(self.manifest["segments"])
+                merged_tombstones = [doc_id for doc_id, tombstone in self.manifest["tombstones"].items() if tombstone["segment"] in names]
+                if len(names) < 2 and not merged_tombstones:
+                    return
+                segments = [self.segments[name] for name in names]
+                deleted_pages = self.deleted_pages
+                deleted_docs = set(self.manifest["tombstones"])
+                name = self._new_segment_name()
+                self._save_manifest()
+
+            items = []
+            streams = [segment.index.items() for segment in segments]
+            for word, group in groupby(heapq.merge(*streams, key=lambda item: item[0]), key=lambda item: item[0]):
+                postings = PostingList()
+                for _, segment_postings in group:
+                    postings = postings.union(segment_postings)
+                postings = postings.difference(deleted_pages)
+                if postings:
+                    items.append((word, postings))
+            text = {}
+            spans = {}
+            graph = PageRank()
+            for segment in segments:
+                for page, page_text in segment.text.items():
+                    if str(locate(page)[0]) not in deleted_docs:
+                        text[page] = page_text
+                        spans[page] = segment.spans[page]
+                for page, links in segment.graph.graph.items():
+                    if str(locate(page)[0]) not in deleted_docs:
+                        graph.graph[page].extend(links)
+            merged = Segment.write(os.path.join(self.path, name), items, text, spans, graph)
+
+            with self.lock:
+                self.manifest["segments"] = [name] + [other for other in self.manifest["segments"] if other not in names]
+                for document in self.manifest["documents"].values():
+                    if document["segment"] in names:
+                        document["segment"] = name
+                for doc_id in merged_tombstones:
+                    del self.manifest["tombstones"][doc_id]
+                for tombstone in self.manifest["tombstones"].values():
+                    if tombstone["segment"] in names:
+                        tombstone["segment"] = name
+                self._save_manifest()
+                segments = {name: merged}
+                segments.update((other, segment) for other, segment in self.segments.items() if other not in names)
+                self.segments = segments
+                self.deleted_pages = self._deleted_pages()
+                self.spelling = None
+            for old in names:
+                shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+
+    def search(self, word):
+        postings = PostingList()
+        for segment in list(self.segments.values()):
+            postings = postings.union(segment.index.search(word))
+        return postings.difference(self.deleted_pages)
+
+    def document_frequency(self, word):
+        return sum(segment.index.document_frequency(word) for segment in list(self.segments.values()))
+
+    def expand(self, pattern, limit=WILDCARD_EXPANSIONS):
+        frequencies = defaultdict(int)
+        for segment in list(self.segments.values()):
+            for word, frequency in segment.index.expand(pattern, limit=None):
+                frequencies[word] += frequency
+        return heapq.nsmallest(limit, frequencies.items(), key=lambda match: (-match[1], match[0]))
+
+    @property
+    def page_lengths(self):
+        documents = self.documents()
+        page_lengths = {}
+        for segment in list(self.segments.values()):
+            for page, length in segment.index.page_lengths.items():
+                if locate(page)[0] in documents:
+                    page_lengths[page] = length
+        return page_lengths
+
+    def did_you_mean(self, query):
+        if self.spelling is None:
+            spelling = SpellingIndex()
+            for segment in list(self.segments.values()):
+                for word, frequency in segment.index.frequencies():
+                    spelling.add(word, frequency)
+            self.spelling = spelling
+        return did_you_mean(query, self.spelling)
+
+    def generate_graph(self):
+        graph = PageRank()
+        documents = self.documents()
+        for segment in list(self.segments.values()):
+            for page, links in segment.graph.graph.items():
+                if locate(page)[0] in documents:
+                    graph.graph[page].extend(links)
+        graph.calculate_page_rank(page_id(doc_id, page) for doc_id, document in documents.items() for page in range(document["pages"]))
+        return graph
@@ -0,0 +1,295 @@
+import heapq
+import mmap
+import os
+import re
+import struct
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from trie import serialize, deserialize
+from postings import PostingList, EMPTY
+from consts import *
+
+# Every index file starts with HEADER: magic, format version and record count.
+#   terms.bin    - UTF-8 terms concatenated in sorted (byte) order
+#   offsets.bin  - one RECORD per term: term offset/length in terms.bin,
+#                  postings offset/length in postings.bin, document frequency
+#   postings.bin - per term, a compressed PostingList (see postings.py)
+# stats.bin holds the number of words on every page, used for scoring.
+# permuterm.bin has a PERMUTERM record (term number, byte shift) for every
+# rotation of every term followed by "$", sorted by the rotated bytes, so a
+# wildcard X*Y is answered by a prefix lookup for Y$X.
+HEADER = struct.Struct("<4sII")
+RECORD = struct.Struct("<IIQII")
+PERMUTERM = struct.Struct("<IH")
+TERMS_MAGIC = b"SETM"
+OFFSETS_MAGIC = b"SEOF"
+POSTINGS_MAGIC = b"SEPO"
+PERMUTERM_MAGIC = b"SEPT"
+INDEX_VERSION = 2
+
+
+class _Keys:
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.index._term_bytes(i)
+
+
+def rotate(term, shift):
+    term += b"$"
+    return term[shift:] + term[:shift]
+
+
+class _Rotations:
+    def __init__(self, index, data):
+        self.index = index
+        self.data = data
+        self.count = HEADER.unpack_from(data)[2]
+
+    def __len__(self):
+        return self.count
+
+    def term(self, j):
+        return PERMUTERM.unpack_from(self.data, HEADER.size + j * PERMUTERM.size)
+
+    def __getitem__(self, j):
+        i, shift = self.term(j)
+        return rotate(self.index._term_bytes(i), shift)
+
+
+class DiskIndex:
+    def __init__(self, path=INDEX_DIR):
+        self.path = path
+        self._files = []
+        self.terms = self._open(TERMS_FILE, TERMS_MAGIC)
+        self.offsets = self._open(OFFSETS_FILE, OFFSETS_MAGIC)
+        self.postings = self._open(POSTINGS_FILE, POSTINGS_MAGIC)
+        self.count = HEADER.unpack_from(self.offsets)[2]
+        self._keys = _Keys(self)
+        self._rotations = None
+        if os.path.exists(os.path.join(self.path, PERMUTERM_FILE)):
+            self._load_permuterm()
+        self.page_lengths = self._load_stats()
+
+    def _load_stats(self):
+        stats_path = os.path.join(self.path, STATS_FILE)
+        if not os.path.exists(stats_path):
+            page_lengths = defaultdict(int)
+            for _, postings in self.items():
+                for page, frequency in postings.frequencies():
+                    page_lengths[page] += frequency
+            write_stats(self.path, page_lengths)
+        with open(stats_path, "rb") as file:
+            stats = deserialize(file.read())
+        return dict(zip(stats["pages"], stats["lengths"]))
+
+    def _load_permuterm(self):
+        if self._rotations is None:
+            if not os.path.exists(os.path.join(self.path, PERMUTERM_FILE)):
+                write_permuterm(self.path, (self._term_bytes(i) for i in range(self.count)))
+            self._rotations = _Rotations(self, self._open(PERMUTERM_FILE, PERMUTERM_MAGIC))
+        return self._rotations
+
+    def _open(self, name, magic):
+        file = open(os.path.join(self.path, name), "rb")
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._files.append((file, data))
+        file_magic, version, _ = HEADER.unpack_from(data)
+        if file_magic != magic:
+            raise ValueError(f"{name} is not a search engine index file.")
+        if version != INDEX_VERSION:
+            raise ValueError(f"{name} has index version {version}, expected {INDEX_VERSION}.")
+        return data
+
+    # Index directories are snapshots that are never rewritten once
+    # published, so the path identifies the version. It stays valid after the
+    # snapshot has been pruned, while the open files are still mapped.
+    def version(self):
+        return self.path
+
+    def close(self):
+        for file, data in self._files:
+            data.close()
+            file.close()
+        self._files = []
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, word):
+        return self._find(word) is not None
+
+    def _record(self, i):
+        return RECORD.unpack_from(self.offsets, HEADER.size + i * RECORD.size)
+
+    def _term_bytes(self, i):
+        term_offset, term_length, _, _, _ = self._record(i)
+        start = HEADER.size + term_offset
+        return self.terms[start:start + term_length]
+
+    def _postings(self, i):
+        _, _, postings_offset, postings_length, _ = self._record(i)
+        start = HEADER.size + postings_offset
+        return PostingList.from_bytes(self.postings[start:start + postings_length])
+
+    def _find(self, word):
+        key = word.encode("utf-8")
+        i = bisect_left(self._keys, key)
+        if i < self.count and self._keys[i] == key:
+            return i
+        return None
+
+    def search(self, word):
+        i = self._find(word)
+        if i is None:
+            return EMPTY
+        return self._postings(i)
+
+    def document_frequency(self, word):
+        i = self._find(word)
+        if i is None:
+            return 0
+        return self._record(i)[4]
+
+    def _prefix_range(self, prefix):
+        key = prefix.encode("utf-8")
+        i = bisect_left(self._keys, key)
+        while i < self.count:
+            term = self._keys[i]
+            if not term.startswith(key):
+                break
+            yield i, term.decode("utf-8")
+            i += 1
+
+    def _wildcard_range(self, pattern):
+        parts = pattern.split("*")
+        if len(parts) == 1:
+            i = self._find(pattern)
+            if i is not None:
+                yield i, pattern
+            return
+        if len(parts) == 2 and not parts[1]:
+            yield from self._prefix_range(parts[0])
+            return
+        rotations = self._load_permuterm()
+        key = f"{parts[-1]}${parts[0]}".encode("utf-8")
+        pattern = re.compile(".*".join(re.escape(part) for part in parts), re.DOTALL)
+        j = bisect_left(rotations, key)
+        while j < len(rotations) and rotations[j].startswith(key):
+            i = rotations.term(j)[0]
+            word = self._term_bytes(i).decode("utf-8")
+            if len(parts) == 2 or pattern.fullmatch(word):
+                yield i, word
+            j += 1
+
+    # Terms matching a pattern with any number of "*" wildcards, most frequent
+    # first. Only the `limit` most frequent are kept, so a short prefix does
+    # not pull in thousands of posting lists.
+    def expand(self, pattern, limit=WILDCARD_EXPANSIONS):
+        matches = ((word, self._record(i)[4]) for i, word in self._wildcard_range(pattern))
+        if limit is None:
+            return sorted(matches, key=lambda match: (-match[1], match[0]))
+        return heapq.nsmallest(limit, matches, key=lambda match: (-match[1], match[0]))
+
+    def words(self):
+        for i in range(self.count):
+            yield self._keys[i].decode("utf-8")
+
+    def frequencies(self):
+        for i in range(self.count):
+            yield self._keys[i].decode("utf-8"), self._record(i)[4]
+
+    def items(self):
+        for i in range(self.count):
+            yield self._keys[i].decode("utf-8"), self._postings(i)
+
+
+def write_index(path, items, presorted=False):
+    os.makedirs(path, exist_ok=True)
+    if not presorted:
+        items = sorted(items, key=lambda item: item[0])
+    terms = bytearray()
+    records = bytearray()
+    term_list = []
+    count = 0
+    page_lengths = defaultdict(int)
+    with open(os.path.join(path, POSTINGS_FILE), "wb") as postings_file:
+        postings_file.write(HEADER.pack(POSTINGS_MAGIC, INDEX_VERSION, 0))
+        postings_offset = 0
+        for word, postings in items:
+            if not isinstance(postings, PostingList):
+                postings = PostingList.from_postings(postings)
+            term = word.encode("utf-8")
+            data = postings.to_bytes()
+            for page, frequency in postings.frequencies():
+                page_lengths[page] += frequency
+            records += RECORD.pack(len(terms), len(term), postings_offset, len(data), postings.doc_count)
+            terms += term
+            term_list.append(term)
+            postings_file.write(data)
+            postings_offset += len(data)
+            count += 1
+    with open(os.path.join(path, TERMS_FILE), "wb") as file:
+        file.write(HEADER.pack(TERMS_MAGIC, INDEX_VERSION, count))
+        file.write(terms)
+    with open(os.path.join(path, OFFSETS_FILE), "wb") as file:
+        file.write(HEADER.pack(OFFSETS_MAGIC, INDEX_VERSION, count))
+        file.write(records)
+    write_stats(path, page_lengths)
+    write_permuterm(path, term_list)
+
+
+def write_permuterm(path, terms):
+    rotations = []
+    for i, term in enumerate(terms):
+        for shift in range(len(term) + 1):
+            if shift == len(term) or term[shift] & 0xC0 != 0x80:
+                rotations.append((rotate(term, shift), i, shift))
+    rotations.sort()
+    records = bytearray()
+    for _, i, shift in rotations:
+        records += PERMUTERM.pack(i, shift)
+    with open(os.path.join(path, PERMUTERM_FILE), "wb") as file:
+        file.write(HEADER.pack(PERMUTERM_MAGIC, INDEX_VERSION, len(rotations)))
+        file.write(records)
+
+
+def write_stats(path, page_lengths):
+    pages = sorted(page_lengths)
+    stats = {
+        "pages": array("Q", pages),
+        "lengths": array("I", (page_lengths[page] for page in pages)),
+    }
+    with open(os.path.join(path, STATS_FILE), "wb") as file:
+        file.write(serialize(stats))
+
+
+def convert_trie(trie_path=TRIE_PATH, index_path=INDEX_DIR):
+    with open(trie_path, "rb") as file:
+        trie = deserialize(file.read())
+    write_index(index_path, trie.items())
+
+
+def load_index(path=INDEX_DIR):
+    return DiskIndex(path)
+
+
+def index_exists(path=INDEX_DIR):
+    for name in (TERMS_FILE, OFFSETS_FILE, POSTINGS_FILE):
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) < HEADER.size:
+            return False
+        with open(file_path, "rb") as file:
+            if HEADER.unpack(file.read(HEADER.size))[1] != INDEX_VERSION:
+                return False
+    return True
+
+
+if __name__ == "__main__":
+    convert_trie()
+    print(f"Converted {TRIE_PATH} to {INDEX_DIR}/")
@@ -0,0 +1,95 @@
+import heapq
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from itertools import groupby
+from consts import BUILD_MEMORY
+from disk_index import write_index
+from postings import PostingList, union_all
+
+# A run is a sorted sequence of RUN_RECORDs, each followed by the UTF-8 term
+# and the term's PostingList bytes.
+RUN_RECORD = struct.Struct("<II")
+
+
+def write_run(path, items):
+    with open(path, "wb") as file:
+        for word, postings in items:
+            term = word.encode("utf-8")
+            data = postings.to_bytes()
+            file.write(RUN_RECORD.pack(len(term), len(data)))
+            file.write(term)
+            file.write(data)
+
+
+def read_run(path):
+    with open(path, "rb") as file:
+        while True:
+            record = file.read(RUN_RECORD.size)
+            if not record:
+                return
+            term_length, data_length = RUN_RECORD.unpack(record)
+            word = file.read(term_length).decode("utf-8")
+            yield word, PostingList.from_bytes(file.read(data_length))
+
+
+# Single-pass in-memory indexing (SPIMI): postings are collected per word as
+# flat (page, position) arrays until they reach `memory_budget` bytes, then
+# sorted by word and spilled to a run file. finish() merges the runs and the
+# postings still in memory word by word, so the index is written without
+# ever holding more than one budget's worth of postings.
+class IndexBuilder:
+    def __init__(self, path, memory_budget=BUILD_MEMORY):
+        self.path = path
+        self.memory_budget = memory_budget
+        self.postings = {}
+        self.size = 0
+        self.runs = []
+        self.run_dir = None
+
+    def add(self, postings):
+        for word, word_postings in postings.items():
+            entries = self.postings.get(word)
+            if entries is None:
+                entries = self.postings[word] = array("I")
+                self.size += len(word) + 128
+            for page, position in word_postings:
+                entries.append(page)
+                entries.append(position)
+            self.size += 8 * len(word_postings)
+        if self.size >= self.memory_budget:
+            self.spill()
+
+    def sorted_items(self):
+        for word in sorted(self.postings):
+            entries = self.postings[word]
+            yield word, PostingList.from_postings(zip(entries[0::2], entries[1::2]))
+
+    def spill(self):
+        if not self.postings:
+            return
+        if self.run_dir is None:
+            os.makedirs(self.path, exist_ok=True)
+            self.run_dir = tempfile.mkdtemp(prefix=".runs-", dir=self.path)
+        path = os.path.join(self.run_dir, f"run_{len(self.runs)}.bin")
+        write_run(path, self.sorted_items())
+        self.runs.append(path)
+        self.postings = {}
+        self.size = 0
+
+    def merged_items(self):
+        streams = [read_run(path) for path in self.runs] + [self.sorted_items()]
+        for word, group in groupby(heapq.merge(*streams, key=lambda item: item[0]), key=lambda item: item[0]):
+            yield word, union_all([postings for _, postings in group])
+
+    def finish(self):
+        try:
+            write_index(self.path, self.merged_items(), presorted=True)
+        finally:
+            self.postings = {}
+            self.size = 0
+            if self.run_dir is not None:
+                shutil.rmtree(self.run_dir, ignore_errors=True)
+                self.run_dir = None
@@ -1,36 +1,103 @@
 from pdf_parser import PDFParser
+from corpus import Corpus
 from search_engine import SearchEngine
-from tokenizer import Tokenizer
-from consts import ORANGE, GREEN, RESET
+from server import SearchService, serve
+from batch import BatchRunner, read_queries
+from shards import ShardedSearch, build_shards, shards_fresh
+from snapshots import SnapshotWatcher
+from consts import ORANGE, GREEN, RESET, EXPORT, DOCUMENT, SERVER_HOST, SERVER_PORT, BUILD_MEMORY, RESULTS_PAGE_SIZE
+import argparse
+import os
+import sys
 
 
 if __name__ == "__main__":
-    parser = PDFParser("Data Structures and Algorithms in Python.pdf")
-    search_engine = SearchEngine(parser.trie, parser.text, parser.generate_graph())
+    arguments = argparse.ArgumentParser(description="Search engine for PDF documents.")
+    arguments.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of processes used to build the index or to serve requests")
+    arguments.add_argument("--rebuild", action="store_true", help="rebuild the index from the PDF")
+    arguments.add_argument("--memory", type=int, default=BUILD_MEMORY // 2 ** 20, metavar="MB", help="postings held in memory while indexing before they are spilled to disk")
+    arguments.add_argument("--boxes", action="store_true", help="record word rectangles while indexing")
+    arguments.add_argument("--export", action="store_true", help=f"highlight matches on the original pages of the PDF, saved to {EXPORT}")
+    arguments.add_argument("--ranking", choices=["bm25", "frequency"], default="bm25", help="how results are ordered")
+    arguments.add_argument("--explain", action="store_true", help="print the query plan with estimated and actual result sizes")
+    arguments.add_argument("--corpus", action="store_true", help="search the multi-document corpus instead of the bundled PDF")
+    arguments.add_argument("--add", nargs="+", default=[], metavar="PDF", help="add documents to the corpus")
+    arguments.add_argument("--remove", nargs="+", type=int, default=[], metavar="DOC_ID", help="remove documents from the corpus")
+    arguments.add_argument("--merge", action="store_true", help="compact the corpus segments")
+    arguments.add_argument("--shards", type=int, default=0, metavar="N", help="split the index into N shards searched by separate processes")
+    arguments.add_argument("--profile", action="store_true", help="print a per-stage time and counter breakdown after each query")
+    arguments.add_argument("--batch", type=argparse.FileType("r"), metavar="FILE", help="run the queries in FILE (- for stdin), one per line, and write one JSON line per query")
+    arguments.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout, metavar="PATH", help="where --batch writes its JSON lines (default: stdout)")
+    arguments.add_argument("--size", type=int, default=RESULTS_PAGE_SIZE, help="results per query in --batch mode")
+    arguments.add_argument("--snippets", action="store_true", help="include snippets in --batch results")
+    arguments.add_argument("--serve", action="store_true", help="serve search, suggest and autocomplete as JSON over HTTP")
+    arguments.add_argument("--host", default=SERVER_HOST, help="address to serve on")
+    arguments.add_argument("--port", type=int, default=SERVER_PORT, help="port to serve on")
+    args = arguments.parse_args()
+
+    if args.corpus or args.add or args.remove or args.merge:
+        parser = Corpus()
+        for path in args.add:
+            doc_id = parser.add_document(path, workers=args.workers)
+            print(f"Added {path} as document {doc_id}.")
+        for doc_id in args.remove:
+            parser.remove_document(doc_id)
+            print(f"Removed document {doc_id}.")
+        if args.merge:
+            parser.merge_segments()
+        search_engine = SearchEngine(parser, parser.text, parser.page_rank, parser.spans, ranking=args.ranking, explain=args.explain, report=not (args.serve or args.batch), profile=args.profile)
+    else:
+        parser = PDFParser(DOCUMENT, workers=args.workers, rebuild=args.rebuild, boxes=args.boxes or args.export, memory_budget=args.memory * 2 ** 20)
+        if args.shards:
+            if not shards_fresh(args.shards, index_path=parser.index_path):
+                build_shards(args.shards, index_path=parser.index_path)
+            # Forking again after the shard processes are running would
+            # share their pipes, so sharded serving and batches use one process.
+            args.workers = 1
+            search_engine = ShardedSearch(parser.trie, ranking=args.ranking, profile=args.profile, spelling_path=parser.spelling_path)
+        else:
+            # A batch runs on one snapshot; otherwise rebuilds are picked up as they are published.
+            snapshots = None if args.batch else SnapshotWatcher(parser.index_path, lambda path: parser.open_snapshot(path, boxes=args.export, spelling=True))
+            search_engine = SearchEngine(parser.trie, parser.text, parser.page_rank, parser.spans, ranking=args.ranking, explain=args.explain,
+                                         boxes=parser.boxes if args.export else None, source=parser.document_path, report=not (args.serve or args.batch), profile=args.profile,
+                                         snapshots=snapshots, spelling_path=parser.spelling_path)
+    if args.serve:
+        serve(SearchService(search_engine), args.host, args.port, args.workers)
+        raise SystemExit
+    if args.batch:
+        summary = BatchRunner(search_engine, args.size, args.snippets).run(read_queries(args.batch), args.output, args.workers)
+        print(f"{summary['queries']} queries in {summary['seconds']:.2f}s ({summary['queries_per_second']:.1f} queries/s, "
+              f"p50 {summary['p50_ms']:.2f}ms, p95 {summary['p95_ms']:.2f}ms, {summary['errors']} error(s), {summary['workers']} worker(s))", file=sys.stderr)
+        raise SystemExit
     print(f"{ORANGE}\nWelcome to the search engine!{RESET}\n")
     print("Make sure to read the instructions before using the search engine.")
     print(f" - Use {GREEN}AND{RESET}/{GREEN}OR{RESET}/{GREEN}NOT{RESET} for more specific search queries.")
-    print(f" - Add {GREEN}*{RESET} after a word for autocomplete suggestions (e.g., radi* matches radio, radix, etc.).")
+    print(f" - Use {GREEN}*{RESET} as a wildcard anywhere in a word (e.g., radi* matches radio, radix, etc., *sort and heap*fy also work).")
     print(f" - Use {GREEN}\"\"{RESET} for exact phrase search.")
+    print(f" - Use {GREEN}NEAR/k{RESET} to find words within k words of each other, {GREEN}ONEAR/k{RESET} to also keep them in order (e.g., heap NEAR/5 sort).")
     print(f" - Utilize the {GREEN}Did you mean?{RESET} feature for spelling suggestions.\n")
 
     while True:
         query = input(f"\n{ORANGE}  Enter your query: {RESET}")
         print()
         if query.lower() == "x":
+            search_engine.close()
+            print(search_engine if isinstance(search_engine, ShardedSearch) else search_engine.cache)
+            if args.profile:
+                print(search_engine.profiler)
             print("Goodbye!\n")
             break
-        query = query.replace("(", "").replace(")", "")
         is_only_words = True
-        forbidden = [" and ", " or ", " not ", "*", '"']
+        forbidden = [" and ", " or ", " not ", "near/", "*", '"', "(", ")"]
         is_only_words = not any(f in query.lower() for f in forbidden)
         if is_only_words:
-            did_you_mean = parser.did_you_mean(query)
-            if query != did_you_mean:
+            did_you_mean = search_engine.did_you_mean(query)
+            if query.lower() != did_you_mean:
                 anw = input(f"Did you mean {GREEN}{did_you_mean.upper()}{RESET} (y/n): ")
                 print()
                 if anw.lower() == "y":
                     query = did_you_mean
-        tokenizer = Tokenizer(query)
-        terms, operations = tokenizer.tokenize()
-        search_engine.search(terms, operations)
\ No newline at end of file
+        try:
+            search_engine.search(query)
+        except RuntimeError as e:
+            print(f"Error: {e}")
\ No newline at end of file
@@ -1,43 +1,101 @@
+from array import array
 from collections import defaultdict
+from trie import serialize, deserialize
 import re
 
 
 class PageRank:
     def __init__(self):
         self.graph = defaultdict(list)
-        self.rank = defaultdict(float)
-        self.word_count = defaultdict(int)
+        self.rank = {}
+        self.report = {}
 
     def add_edge(self, from_page, to_page):
         self.graph[from_page].append(to_page)
 
-    def set_word_count(self, page, count):
-        self.word_count[page] = count
-
-    def calculate_page_rank(self, num_pages, d: float = 0.85, max_iterations: int = 100, tol: float = 1e-6):
-        for page in range(1, num_pages + 1):
-            self.rank[page] = 1.0 / num_pages
-
-        for iteration in range(max_iterations):
-            new_rank = defaultdict(float)
-            for page in range(1, num_pages + 1):
-                summation = 0
-                for referring_page in self.graph:
-                    if page in self.graph[referring_page]:
-                        count = self.word_count[referring_page]
-                        out_degree = len(self.graph[referring_page])
-                        if out_degree > 0:
-                            summation += self.rank[referring_page] * count / out_degree
-                new_rank[page] = (1 - d) + d * summation
-            
-            if all(abs(new_rank[page] - self.rank[page]) < tol for page in range(1, num_pages + 1)):
+    def nodes(self, pages=()):
+        nodes = set(range(pages)) if isinstance(pages, int) else set(pages)
+        for page, links in self.graph.items():
+            nodes.add(page)
+            nodes.update(links)
+        return sorted(nodes)
+
+    def to_csr(self, nodes):
+        node_index = {node: i for i, node in enumerate(nodes)}
+        indptr = array("I", [0])
+        indices = array("I")
+        for node in nodes:
+            for destination in self.graph.get(node, ()):
+                indices.append(node_index[destination])
+            indptr.append(len(indices))
+        return indptr, indices
+
+    def calculate_page_rank(self, pages, d: float = 0.85, max_iterations: int = 100, tol: float = 1e-6):
+        nodes = self.nodes(pages)
+        num_pages = len(nodes)
+        if num_pages == 0:
+            self.rank = {}
+            self.report = {"pages": 0, "edges": 0, "iterations": 0, "residual": 0.0, "converged": True}
+            return self.report
+        indptr, indices = self.to_csr(nodes)
+        out_degree = [indptr[i + 1] - indptr[i] for i in range(num_pages)]
+        dangling = [i for i in range(num_pages) if out_degree[i] == 0]
+        rank = array("d", [1.0 / num_pages]) * num_pages
+
+        residual = 0.0
+        iteration = 0
+        for iteration in range(1, max_iterations + 1):
+            dangling_rank = sum(rank[i] for i in dangling)
+            new_rank = array("d", [(1 - d) / num_pages + d * dangling_rank / num_pages]) * num_pages
+            for i in range(num_pages):
+                if out_degree[i]:
+                    share = d * rank[i] / out_degree[i]
+                    for j in indices[indptr[i]:indptr[i + 1]]:
+                        new_rank[j] += share
+            residual = sum(abs(new - old) for new, old in zip(new_rank, rank))
+            rank = new_rank
+            if residual < tol:
                 break
-            
-            self.rank = new_rank
+
+        self.rank = dict(zip(nodes, rank))
+        self.report = {
+            "pages": num_pages,
+            "edges": len(indices),
+            "iterations": iteration,
+            "residual": residual,
+            "converged": residual < tol,
+        }
+        return self.report
 
     def get_page_rank(self):
         return dict(self.rank)
 
+    def save(self, path):
+        nodes = self.nodes(self.rank)
+        indptr, indices = self.to_csr(nodes)
+        data = {
+            "nodes": array("Q", nodes),
+            "indptr": indptr,
+            "indices": indices,
+            "rank": array("d", (self.rank.get(node, 0.0) for node in nodes)),
+            "report": self.report,
+        }
+        with open(path, "wb") as file:
+            file.write(serialize(data))
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as file:
+            data = deserialize(file.read())
+        page_rank = PageRank()
+        nodes, indptr, indices = data["nodes"], data["indptr"], data["indices"]
+        for i, node in enumerate(nodes):
+            for j in indices[indptr[i]:indptr[i + 1]]:
+                page_rank.add_edge(node, nodes[j])
+        page_rank.rank = dict(zip(nodes, data["rank"]))
+        page_rank.report = data["report"]
+        return page_rank
+
     def extract_links(self, text):
         pattern = re.compile(r'\b(?:see page|see pages|on page)\s+(\d+(?:\s*and\s*\d+)*)', re.IGNORECASE)
         matches = pattern.findall(text)
@@ -47,9 +105,9 @@ class PageRank:
             for page in pages:
                 links.append(int(page))
         return links
-    
+
     def __str__(self) -> str:
         ans = ""
         for page, links in self.graph.items():
             ans += f"Page {page}: {links}\n"
-        return ans
\ No newline at end of file
+        return ans
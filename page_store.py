@@ -0,0 +1,106 @@
+import mmap
+import os
+import shutil
+import struct
+from array import array
+
+# A page store maps page numbers to byte blobs, all kept in a single file:
+#   HEADER, then `count` page numbers, `count + 1` blob offsets (relative to
+#   the start of the data) and the blobs themselves, in page number order.
+HEADER = struct.Struct("<4sII")
+PAGE_STORE_MAGIC = b"SEPS"
+PAGE_STORE_VERSION = 1
+
+
+def write_page_store(path, pages):
+    with PageStoreWriter(path) as writer:
+        for page, blob in sorted(pages):
+            writer.add(page, blob)
+
+
+# Writes a page store one page at a time, with pages added in ascending
+# order. Blobs go to a scratch file until close(), when the page and offset
+# tables are known, so only the tables are held in memory.
+class PageStoreWriter:
+    def __init__(self, path):
+        self.path = path
+        self.numbers = array("Q")
+        self.offsets = array("Q", [0])
+        self.data = open(path + ".data", "w+b")
+
+    def add(self, page, blob):
+        if self.numbers and page <= self.numbers[-1]:
+            raise ValueError(f"Page {page} was added after page {self.numbers[-1]}.")
+        self.numbers.append(page)
+        self.offsets.append(self.offsets[-1] + len(blob))
+        self.data.write(blob)
+
+    def close(self):
+        with open(self.path + ".tmp", "wb") as file:
+            file.write(HEADER.pack(PAGE_STORE_MAGIC, PAGE_STORE_VERSION, len(self.numbers)))
+            file.write(self.numbers.tobytes())
+            file.write(self.offsets.tobytes())
+            self.data.seek(0)
+            shutil.copyfileobj(self.data, file)
+        self.discard()
+        os.replace(self.path + ".tmp", self.path)
+
+    def discard(self):
+        self.data.close()
+        os.remove(self.path + ".data")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+
+class PageStore:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.close()
+            raise ValueError(f"{path} is empty.")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self.data)
+        if magic != PAGE_STORE_MAGIC:
+            raise ValueError(f"{path} is not a search engine page store.")
+        if version != PAGE_STORE_VERSION:
+            raise ValueError(f"{path} has page store version {version}, expected {PAGE_STORE_VERSION}.")
+        start = HEADER.size
+        self.numbers = array("Q", self.data[start:start + 8 * count])
+        start += 8 * count
+        self.offsets = array("Q", self.data[start:start + 8 * (count + 1)])
+        self.start = start + 8 * (count + 1)
+        self.pages = {page: i for i, page in enumerate(self.numbers)}
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __contains__(self, page):
+        return page in self.pages
+
+    def __iter__(self):
+        return iter(self.numbers)
+
+    def keys(self):
+        return list(self.numbers)
+
+    def __getitem__(self, page):
+        i = self.pages[page]
+        return self.data[self.start + self.offsets[i]:self.start + self.offsets[i + 1]]
+
+    def get(self, page, default=None):
+        if page not in self.pages:
+            return default
+        return self[page]
@@ -0,0 +1,59 @@
+import zlib
+from cache import LRUCache
+from consts import PAGE_TEXT_CACHE
+from trie import deserialize
+from page_store import PageStore, write_page_store
+
+
+def compress_page(page_text, level=6):
+    return zlib.compress(page_text.encode("utf-8"), level)
+
+
+def write_page_text(path, text):
+    write_page_store(path, ((page, compress_page(page_text)) for page, page_text in text.items()))
+
+
+# Indexes built before the page store kept the text as one pickled dict.
+def convert_page_text(legacy_path, path):
+    with open(legacy_path, "rb") as file:
+        write_page_text(path, deserialize(file.read()))
+
+
+# Read-only mapping of page number to page text. Every page is compressed on
+# its own, so looking one up only inflates that page; recently used pages are
+# kept decompressed in a small LRU cache.
+class PageTextStore:
+    def __init__(self, path, cache_entries=PAGE_TEXT_CACHE):
+        self.store = PageStore(path)
+        self.cache = LRUCache(max_entries=cache_entries)
+
+    def close(self):
+        self.store.close()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, page):
+        return page in self.store
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def keys(self):
+        return self.store.keys()
+
+    def __getitem__(self, page):
+        text = self.cache.get(page)
+        if text is None:
+            text = zlib.decompress(self.store[page]).decode("utf-8")
+            self.cache.put(page, text, len(text))
+        return text
+
+    def get(self, page, default=None):
+        if page not in self.store:
+            return default
+        return self[page]
+
+    def items(self):
+        for page in self.store:
+            yield page, zlib.decompress(self.store[page]).decode("utf-8")
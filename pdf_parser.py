@@ -1,53 +1,259 @@
 import fitz
 import re
-from trie import *
 import os
+import shutil
+import time
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from consts import *
-import Levenshtein
 from page_rank import PageRank
+from spelling import SpellingIndex
+from disk_index import convert_trie, load_index, index_exists
+from index_builder import IndexBuilder
+from page_store import PageStoreWriter
+from snippets import WORD, load_spans, SpanStore
+from boxes import write_boxes, BoxStore
+from page_text import compress_page, convert_page_text, PageTextStore
+from snapshots import stage, publish, current_snapshot, verify_snapshot, record_file
+
+
+def split_words(text):
+    words = re.split(r'\W+', text)
+    words = [word.lower() for word in words if word]
+    return words
+
+
+def index_pages(document, start, end):
+    text = {}
+    postings = defaultdict(list)
+    spans = {}
+    for page_number in range(start, end):
+        page_text = document[page_number].get_text("text")
+        text[page_number] = page_text
+        page_spans = spans[page_number] = array("I")
+        for position, match in enumerate(WORD.finditer(page_text)):
+            postings[match.group().lower()].append((page_number, position))
+            page_spans.append(match.start())
+            page_spans.append(match.end())
+    return text, postings, spans
+
+
+def index_page_range(document_path, start, end):
+    document = fitz.open(document_path)
+    try:
+        return index_pages(document, start, end)
+    finally:
+        document.close()
+
+
+# Yields (text, postings, spans) for consecutive chunks of at most
+# INDEX_CHUNK_PAGES pages, in page order. With several workers only about
+# `workers` chunks are in flight at once, so finished chunks do not pile up
+# faster than the caller consumes them.
+def partial_indexes(document, document_path, workers=1):
+    page_count = document.page_count
+    chunk_size = max(1, min(-(-page_count // (workers * 4)), INDEX_CHUNK_PAGES))
+    starts = range(0, page_count, chunk_size)
+    ends = [min(start + chunk_size, page_count) for start in starts]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for start, end in zip(starts, ends):
+                pending.append(executor.submit(index_page_range, document_path, start, end))
+                if len(pending) > workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    else:
+        for start, end in zip(starts, ends):
+            yield index_pages(document, start, end)
+
+
+CROSS_REFERENCE = re.compile(r"see\s*page\s*(\d+)|see\s*pages\s*(\d+)\s*and\s*(\d+)|on\s*page\s*(\d+)", re.IGNORECASE)
+
+
+def cross_references(text, page_count):
+    for match in CROSS_REFERENCE.finditer(text):
+        for group in match.groups():
+            if group is not None:
+                destination_page = int(group)
+                if destination_page >= 0 and destination_page < page_count:
+                    yield destination_page
+
+
+def did_you_mean(query, spelling):
+    tokens = query.lower().split()
+    output = []
+    for index, token in enumerate(tokens):
+        output.append(spelling.correct(token))
+
+        if index < len(tokens) - 1:
+            output.append(" ")
+
+    return "".join(output)
+
+
+def load_spelling(index, path=INDEX_DIR):
+    spelling_path = os.path.join(path, SPELLING_FILE)
+    if os.path.exists(spelling_path):
+        return SpellingIndex.load(spelling_path)
+    spelling = SpellingIndex.build(index.frequencies())
+    spelling.save(spelling_path)
+    return spelling
 
 
 class PDFParser:
-    def __init__(self, document):
-        self.document = fitz.open(document)
+    def __init__(self, document, workers=1, rebuild=False, boxes=False, memory_budget=BUILD_MEMORY):
+        self.document_path = document
+        self._document = None
         self.text = {}
-        self.trie = Trie()
-        self.all_words = set()
-        self.deserialize_all()
+        self.spans = {}
+        self.boxes = None
+        self.record_boxes = boxes
+        self.trie = None
+        self._spelling = None
+        self.page_rank = None
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.index_path = None
+        self.deserialize_all(rebuild)
+
+    # The PDF is only opened to (re)build the index or to record boxes; a
+    # fresh index is served entirely from the current snapshot's files.
+    @property
+    def document(self):
+        if self._document is None:
+            self._document = fitz.open(self.document_path)
+        return self._document
+
+    @property
+    def spelling_path(self):
+        return os.path.join(self.index_path, SPELLING_FILE)
+
+    # Only needed for did-you-mean, and by far the slowest file to load.
+    @property
+    def spelling(self):
+        if self._spelling is None:
+            self._spelling = SpellingIndex.load(self.spelling_path)
+        return self._spelling
+
+    @property
+    def all_words(self):
+        return set(self.trie.words())
+
+    def artifacts_fresh(self):
+        if self.index_path is None or not index_exists(self.index_path):
+            return False
+        try:
+            verify_snapshot(self.index_path, checksums=False)
+        except (OSError, ValueError):
+            return False
+        paths = [os.path.join(self.index_path, name) for name in (TERMS_FILE, PAGES_FILE)]
+        if not os.path.exists(paths[-1]):
+            return False
+        if not os.path.exists(self.document_path):
+            return True
+        modified = os.path.getmtime(self.document_path)
+        return all(os.path.getmtime(path) >= modified for path in paths)
 
     def generate_graph(self):
         graph = PageRank()
-        regex = r"see\s*page\s*(\d+)|see\s*pages\s*(\d+)\s*and\s*(\d+)|on\s*page\s*(\d+)"
-        for page in self.document:
-            page_number = page.number
-            text: str = self.text[page_number]
-            matches = re.finditer(regex, text, re.IGNORECASE)
-            for match in matches:
-                for group in match.groups():
-                    if group is not None:
-                        destination_page = int(group)
-                        if destination_page >= 0 and destination_page < self.document.page_count:
-                            graph.add_edge(page_number, destination_page)
+        for page_number, text in self.text.items():
+            for destination_page in cross_references(text, len(self.text)):
+                graph.add_edge(page_number, destination_page)
         return graph
 
+    def build_page_rank(self, path):
+        page_rank = self.generate_graph()
+        report = page_rank.calculate_page_rank(self.text.keys())
+        print(f"PageRank over {report['pages']} pages and {report['edges']} links: {report['iterations']} iterations, residual {report['residual']:.2e}")
+        page_rank.save(os.path.join(path, PAGE_RANK_FILE))
+        return page_rank
+
+    # Streams the document chunk by chunk: page text and word spans are
+    # written out as each chunk arrives and postings go through an
+    # IndexBuilder, so memory use is bounded by the build's memory budget
+    # rather than by the size of the document. Everything is written to a
+    # staging directory that is published as a new snapshot once complete.
     def get_text(self):
-        for page in self.document:
-            page_number = page.number
-            page_text = page.get_text("text")
-            self.text[page_number] = page_text
-            words = self.split_words(page_text)
-            self.all_words.update(words)
-            for position, word in enumerate(words):
-                self.trie.insert(word, page_number, position)
-        serialized_trie = serialize(self.trie)
-        serialized_text = serialize(self.text)
-        serialized_all_words = serialize(self.all_words)
-        with open(TRIE_PATH, "wb") as file:
-            file.write(serialized_trie)
-        with open(TEXT_PATH, "wb") as file:
-            file.write(serialized_text)
-        with open(DICTIONARY, "wb") as file:
-            file.write(serialized_all_words)
+        start_time = time.perf_counter()
+        page_count = self.document.page_count
+        path = stage(INDEX_DIR)
+        try:
+            builder = IndexBuilder(path, self.memory_budget)
+            with PageStoreWriter(os.path.join(path, PAGES_FILE)) as pages, PageStoreWriter(os.path.join(path, SPANS_FILE)) as spans:
+                for text, postings, page_spans in partial_indexes(self.document, self.document_path, self.workers):
+                    for page_number, page_text in text.items():
+                        pages.add(page_number, compress_page(page_text))
+                        spans.add(page_number, page_spans[page_number].tobytes())
+                    builder.add(postings)
+            runs = len(builder.runs)
+            builder.finish()
+            elapsed = time.perf_counter() - start_time
+            print(f"Indexed {page_count} pages in {elapsed:.2f}s ({page_count / elapsed:.1f} pages/s, {self.workers} worker(s), {runs} run(s) spilled)")
+            self.complete_snapshot(path)
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        self.index_path = publish(path, INDEX_DIR)
+
+    # Writes whatever a staged snapshot still lacks besides boxes: spans,
+    # the spelling index and PageRank.
+    def complete_snapshot(self, path):
+        self.text = PageTextStore(os.path.join(path, PAGES_FILE))
+        try:
+            load_spans(os.path.join(path, SPANS_FILE), self.text).close()
+            index = load_index(path)
+            load_spelling(index, path)
+            index.close()
+            if not os.path.exists(os.path.join(path, PAGE_RANK_FILE)):
+                self.build_page_rank(path)
+        finally:
+            self.text.close()
+
+    # Indexes from before snapshots were kept directly in INDEX_DIR, and
+    # older ones as pickles. Either is moved or converted into a snapshot;
+    # returns its path, or None if there is nothing usable to convert.
+    def convert_legacy(self):
+        flat = index_exists(INDEX_DIR)
+        pickled = os.path.exists(TRIE_PATH) and os.path.getsize(TRIE_PATH) > 0
+        if not flat and not pickled:
+            return None
+        path = stage(INDEX_DIR)
+        try:
+            if flat:
+                for name in os.listdir(INDEX_DIR):
+                    if os.path.isfile(os.path.join(INDEX_DIR, name)) and name != CURRENT_FILE:
+                        os.replace(os.path.join(INDEX_DIR, name), os.path.join(path, name))
+            else:
+                convert_trie(TRIE_PATH, path)
+            pages_path = os.path.join(path, PAGES_FILE)
+            if not os.path.exists(pages_path) and os.path.exists(TEXT_PATH):
+                convert_page_text(TEXT_PATH, pages_path)
+            if not os.path.exists(pages_path):
+                shutil.rmtree(path, ignore_errors=True)
+                return None
+            self.complete_snapshot(path)
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        return publish(path, INDEX_DIR)
+
+    # Opens one snapshot's files without touching the parser, so a
+    # SnapshotWatcher can call it from its own thread. The spelling index is
+    # only loaded with `spelling`; otherwise the state reads it on first use.
+    def open_snapshot(self, path, boxes=True, spelling=False):
+        boxes_path = os.path.join(path, BOXES_FILE)
+        return {
+            "trie": load_index(path),
+            "pages_text": PageTextStore(os.path.join(path, PAGES_FILE)),
+            "graph": PageRank.load(os.path.join(path, PAGE_RANK_FILE)),
+            "spans": SpanStore(os.path.join(path, SPANS_FILE)),
+            "boxes": BoxStore(boxes_path) if boxes and os.path.exists(boxes_path) else None,
+            "spelling": SpellingIndex.load(os.path.join(path, SPELLING_FILE)) if spelling else None,
+            "spelling_path": os.path.join(path, SPELLING_FILE),
+        }
     
     def __len__(self):
         return len(self.text)
@@ -56,46 +262,31 @@ class PDFParser:
         return self.text[k]
     
     def split_words(self, text):
-        words = re.split(r'\W+', text)
-        words = [word.lower() for word in words if word]
-        return words
+        return split_words(text)
     
-    def deserialize_all(self):
-        if not os.path.exists(TRIE_PATH) or os.path.getsize(TRIE_PATH) == 0:
+    def deserialize_all(self, rebuild=False):
+        self.index_path = current_snapshot(INDEX_DIR)
+        if not rebuild and self.index_path is None:
+            self.index_path = self.convert_legacy()
+        if rebuild or not self.artifacts_fresh():
             self.get_text()
-        else:
-            with open(TRIE_PATH, "rb") as file:
-                data = file.read()
-                self.trie = deserialize(data)
-            with open(TEXT_PATH, "rb") as file:
-                data = file.read()
-                self.text = deserialize(data)
-            with open(DICTIONARY, "rb") as file:
-                data = file.read()
-                self.all_words = deserialize(data)
+        snapshot = self.open_snapshot(self.index_path)
+        self.trie = snapshot["trie"]
+        self.text = snapshot["pages_text"]
+        self.page_rank = snapshot["graph"]
+        self.spans = snapshot["spans"]
+        self.boxes = snapshot["boxes"]
+        if self.record_boxes and self.boxes is None:
+            boxes_path = os.path.join(self.index_path, BOXES_FILE)
+            write_boxes(boxes_path, self.document, self.text, self.spans)
+            record_file(self.index_path, BOXES_FILE)
+            self.boxes = BoxStore(boxes_path)
 
     def did_you_mean(self, query):
-        tokens = query.split()
-        output = []
-        for index, token in enumerate(tokens):
-            output.append(self.suggest_correction(token))
-
-            if index < len(tokens) - 1:
-                output.append(" ")
-
-        return "".join(output)
+        return did_you_mean(query, self.spelling)
 
     def suggest_correction(self, typed_word):
-        min_distance = float("inf")
-        closest_word = None
-
-        for word in self.all_words:
-            distance = Levenshtein.distance(typed_word, word)
-            if distance < min_distance:
-                min_distance = distance
-                closest_word = word
-
-        return closest_word
+        return self.spelling.correct(typed_word)
     
 
 class PDFHandler:
@@ -103,73 +294,70 @@ class PDFHandler:
         self.pdf_path = pdf_path
         self.doc = fitz.open()
     
-    def create_initial_pdf(self, output_path):
+    def create_initial_pdf(self):
         doc = fitz.open()
         page = doc.new_page()
         page.insert_text((72, 72), "Results:\n\n", fontsize=12)
-        doc.save(output_path)
         return doc
 
-    def add_text(self, doc, text, page_height=792, page_width=612, margin_top=90, margin_bottom=90, margin_left=72, margin_right=72, line_height=14, fontsize=12):
+    # Lays out (heading, snippet) entries and highlights every snippet match.
+    # Match rectangles are measured from the snippet's highlight offsets while
+    # the line is placed, so the rendered pages never have to be searched.
+    def add_text(self, doc, entries, page_height=792, page_width=612, margin_top=90, margin_bottom=90, margin_left=72, margin_right=72, line_height=14, fontsize=12, cancelled=None):
         y = margin_top
-        usable_height = page_height - margin_top - margin_bottom
         usable_width = page_width - margin_left - margin_right
-        
-        average_char_width = 0.5 * fontsize
-
-        for snippet in text:
-            clean_text = re.sub(r'\x1b\[[0-9;]*m', '', snippet)
-            text_lines = clean_text.split('\n')
-
-            for line in text_lines:
-                words = line.split()
-                current_line = ""
-                
-                for word in words:
-                    test_line = f"{current_line} {word}".strip()
-                    text_width = len(test_line) * average_char_width
-
-                    if text_width <= usable_width:
-                        current_line = test_line
-                    else:
-                        if y + line_height > page_height - margin_bottom:
-                            doc.new_page()
-                            y = margin_top
-
-                        doc[-1].insert_text((margin_left, y), current_line, fontsize=fontsize)
-                        y += line_height
-                        current_line = word
-
-                if current_line:
-                    if y + line_height > page_height - margin_bottom:
-                        doc.new_page()
-                        y = margin_top
-
-                    doc[-1].insert_text((margin_left, y), current_line, fontsize=fontsize)
-                    y += line_height
-
-    def highlight_text(self, doc, keyword, phrase):
-        if phrase:
-            for page in doc:
-                phrase_instances = page.search_for(keyword)
-                for inst in phrase_instances:
-                    highlight = page.add_highlight_annot(inst)
-                    highlight.update()
-        else:
-            keywords = keyword.split()
-            for page in doc:
-                phrase_instances = page.search_for(keyword)
-                for inst in phrase_instances:
-                    highlight = page.add_highlight_annot(inst)
-                    highlight.update()
-
-                for word in keywords:
-                    word_instances = page.search_for(f" {word} ")
-                    for inst in word_instances:
-                        highlight = page.add_highlight_annot(inst)
-                        highlight.update()
+
+        def width(text):
+            return fitz.get_text_length(text, fontname="helv", fontsize=fontsize)
+
+        def place(words, highlights):
+            nonlocal y
+            if y + line_height > page_height - margin_bottom:
+                doc.new_page()
+                y = margin_top
+            page = doc[-1]
+            line = " ".join(word for word, _ in words)
+            page.insert_text((margin_left, y), line, fontsize=fontsize)
+            rects = []
+            column = 0
+            for word, start in words:
+                end = start + len(word)
+                for highlight_start, highlight_end in highlights:
+                    if highlight_start < end and highlight_end > start:
+                        left = column + max(highlight_start, start) - start
+                        right = column + min(highlight_end, end) - start
+                        rects.append(fitz.Rect(margin_left + width(line[:left]), y - fontsize, margin_left + width(line[:right]), y + 0.3 * fontsize))
+                column += len(word) + 1
+            if rects:
+                page.add_highlight_annot(rects).update()
+            y += line_height
+
+        for heading, snippet in entries:
+            if cancelled is not None and cancelled():
+                return False
+            text = f"{heading}\n{snippet.text}\n{'-' * 80}"
+            offset = len(heading) + 1
+            highlights = [(start + offset, end + offset) for start, end in snippet.highlights]
+            for line_match in re.finditer(r"[^\n]*", text):
+                words = []
+                for word_match in re.finditer(r"\S+", line_match.group()):
+                    word = (word_match.group(), line_match.start() + word_match.start())
+                    if words and width(" ".join(w for w, _ in words + [word])) > usable_width:
+                        place(words, highlights)
+                        words = []
+                    words.append(word)
+                if words:
+                    place(words, highlights)
+        return True
+
+    def highlight_pages(self, doc, highlights):
+        for page_number, rectangles in highlights.items():
+            if rectangles:
+                page = doc[page_number]
+                page.add_highlight_annot([fitz.Rect(rectangle) for rectangle in rectangles]).update()
 
     def save_pdf(self, doc, output_path):
         if len(doc) == 0:
             raise ValueError("Cannot save an empty PDF document.")
-        doc.save(output_path)
\ No newline at end of file
+        doc.save(output_path + ".tmp")
+        os.replace(output_path + ".tmp", output_path)
@@ -0,0 +1,426 @@
+import heapq
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+# Documents are stored in blocks of BLOCK_SIZE. The docs stream holds, per
+# document, varints for the doc id delta, the number of positions and the
+# byte length of its positions; the positions stream holds the positions of
+# each document as varint deltas. Every block has a skip entry with its last
+# doc id and the offsets of the block in both streams, so lookups only decode
+# the blocks they land in.
+BLOCK_SIZE = 64
+HEADER = struct.Struct("<IIII")
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _gallop(values, target, low):
+    bound = 1
+    while low + bound < len(values) and values[low + bound] < target:
+        bound *= 2
+    return bisect_left(values, target, low + bound // 2, min(low + bound + 1, len(values)))
+
+
+class _Builder:
+    def __init__(self):
+        self.docs = bytearray()
+        self.positions = bytearray()
+        self.skips = array("I")
+        self.doc_count = 0
+        self.length = 0
+        self.last_doc = 0
+
+    def add(self, doc, positions):
+        if self.doc_count % BLOCK_SIZE == 0:
+            self.skips.extend((doc, len(self.docs), len(self.positions)))
+        else:
+            self.skips[-3] = doc
+        start = len(self.positions)
+        previous = 0
+        for position in positions:
+            encode_varint(position - previous, self.positions)
+            previous = position
+        encode_varint(doc - self.last_doc, self.docs)
+        encode_varint(len(positions), self.docs)
+        encode_varint(len(self.positions) - start, self.docs)
+        self.last_doc = doc
+        self.doc_count += 1
+        self.length += len(positions)
+
+    def build(self):
+        return PostingList(self.doc_count, self.length, bytes(self.docs), bytes(self.positions), self.skips)
+
+
+class PostingList:
+    __slots__ = ("doc_count", "length", "docs_data", "positions_data", "skips")
+
+    def __init__(self, doc_count=0, length=0, docs_data=b"", positions_data=b"", skips=None):
+        self.doc_count = doc_count
+        self.length = length
+        self.docs_data = docs_data
+        self.positions_data = positions_data
+        self.skips = skips if skips is not None else array("I")
+
+    @classmethod
+    def from_items(cls, items):
+        builder = _Builder()
+        for doc, positions in items:
+            builder.add(doc, positions)
+        return builder.build()
+
+    @classmethod
+    def from_postings(cls, postings):
+        builder = _Builder()
+        current_doc = None
+        positions = []
+        for doc, position in sorted(postings):
+            if doc != current_doc and positions:
+                builder.add(current_doc, positions)
+                positions = []
+            current_doc = doc
+            positions.append(position)
+        if positions:
+            builder.add(current_doc, positions)
+        return builder.build()
+
+    @classmethod
+    def from_bytes(cls, data):
+        doc_count, length, block_count, docs_length = HEADER.unpack_from(data)
+        skips_end = HEADER.size + block_count * 12
+        skips = array("I")
+        skips.frombytes(data[HEADER.size:skips_end])
+        if sys.byteorder == "big":
+            skips.byteswap()
+        docs_data = data[skips_end:skips_end + docs_length]
+        positions_data = data[skips_end + docs_length:]
+        return cls(doc_count, length, docs_data, positions_data, skips)
+
+    def to_bytes(self):
+        skips = array("I", self.skips)
+        if sys.byteorder == "big":
+            skips.byteswap()
+        header = HEADER.pack(self.doc_count, self.length, len(self.skips) // 3, len(self.docs_data))
+        return header + skips.tobytes() + self.docs_data + self.positions_data
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.doc_count > 0
+
+    def __iter__(self):
+        for doc, positions in self.items():
+            for position in positions:
+                yield doc, position
+
+    def __contains__(self, doc):
+        return Cursor(self).seek(doc) == doc
+
+    def __repr__(self):
+        return f"PostingList(docs={self.doc_count}, positions={self.length})"
+
+    def nbytes(self):
+        return len(self.docs_data) + len(self.positions_data) + self.skips.itemsize * len(self.skips)
+
+    def block_count(self):
+        return len(self.skips) // 3
+
+    def last_docs(self):
+        return self.skips[::3]
+
+    def _block_end(self, block):
+        if block + 1 < self.block_count():
+            return self.skips[3 * block + 4]
+        return len(self.docs_data)
+
+    def decode_block(self, block):
+        offset = self.skips[3 * block + 1]
+        end = self._block_end(block)
+        doc = self.skips[3 * block - 3] if block > 0 else 0
+        position_offset = self.skips[3 * block + 2]
+        docs = array("I")
+        frequencies = array("I")
+        position_offsets = array("I")
+        while offset < end:
+            delta, offset = decode_varint(self.docs_data, offset)
+            frequency, offset = decode_varint(self.docs_data, offset)
+            size, offset = decode_varint(self.docs_data, offset)
+            doc += delta
+            docs.append(doc)
+            frequencies.append(frequency)
+            position_offsets.append(position_offset)
+            position_offset += size
+        return docs, frequencies, position_offsets
+
+    def decode_positions(self, offset, frequency):
+        positions = []
+        position = 0
+        for _ in range(frequency):
+            delta, offset = decode_varint(self.positions_data, offset)
+            position += delta
+            positions.append(position)
+        return positions
+
+    def docs(self):
+        result = array("I")
+        for block in range(self.block_count()):
+            result.extend(self.decode_block(block)[0])
+        return result
+
+    def items(self):
+        for block in range(self.block_count()):
+            docs, frequencies, position_offsets = self.decode_block(block)
+            for i, doc in enumerate(docs):
+                yield doc, self.decode_positions(position_offsets[i], frequencies[i])
+
+    def frequencies(self):
+        for block in range(self.block_count()):
+            docs, frequencies, _ = self.decode_block(block)
+            yield from zip(docs, frequencies)
+
+    def positions(self, doc):
+        cursor = Cursor(self)
+        if cursor.seek(doc) != doc:
+            return []
+        return cursor.positions()
+
+    def intersect(self, other):
+        small, large = (self, other) if self.doc_count <= other.doc_count else (other, self)
+        cursor = Cursor(large)
+        builder = _Builder()
+        for doc, positions in small.items():
+            found = cursor.seek(doc)
+            if found is None:
+                break
+            if found == doc:
+                builder.add(doc, sorted(set(positions).union(cursor.positions())))
+        return builder.build()
+
+    def union(self, other):
+        builder = _Builder()
+        left = self.items()
+        right = other.items()
+        left_item = next(left, None)
+        right_item = next(right, None)
+        while left_item is not None and right_item is not None:
+            if left_item[0] < right_item[0]:
+                builder.add(*left_item)
+                left_item = next(left, None)
+            elif right_item[0] < left_item[0]:
+                builder.add(*right_item)
+                right_item = next(right, None)
+            else:
+                builder.add(left_item[0], sorted(set(left_item[1]).union(right_item[1])))
+                left_item = next(left, None)
+                right_item = next(right, None)
+        for item, rest in ((left_item, left), (right_item, right)):
+            if item is not None:
+                builder.add(*item)
+                for item in rest:
+                    builder.add(*item)
+        return builder.build()
+
+    def slice(self, start, end):
+        cursor = Cursor(self)
+        builder = _Builder()
+        doc = cursor.seek(start)
+        while doc is not None and doc < end:
+            builder.add(doc, cursor.positions())
+            doc = cursor.next()
+        return builder.build()
+
+    def difference(self, other):
+        cursor = Cursor(other)
+        builder = _Builder()
+        for doc, positions in self.items():
+            if cursor.seek(doc) != doc:
+                builder.add(doc, positions)
+        return builder.build()
+
+
+class Cursor:
+    def __init__(self, postings):
+        self.postings = postings
+        self.last_docs = postings.last_docs()
+        self.block = -1
+        self.docs = None
+        self.frequencies = None
+        self.position_offsets = None
+        self.index = 0
+        self.doc = None
+
+    def _load(self, block):
+        self.block = block
+        self.docs, self.frequencies, self.position_offsets = self.postings.decode_block(block)
+        self.index = 0
+
+    def seek(self, doc):
+        if self.block < 0 or self.docs[-1] < doc:
+            block = _gallop(self.last_docs, doc, max(self.block, 0))
+            if block >= len(self.last_docs):
+                self.doc = None
+                return None
+            self._load(block)
+        self.index = _gallop(self.docs, doc, self.index)
+        self.doc = self.docs[self.index]
+        return self.doc
+
+    def next(self):
+        self.index += 1
+        if self.index >= len(self.docs):
+            if self.block + 1 >= len(self.last_docs):
+                self.doc = None
+                return None
+            self._load(self.block + 1)
+        self.doc = self.docs[self.index]
+        return self.doc
+
+    def frequency(self):
+        return self.frequencies[self.index]
+
+    def positions(self):
+        return self.postings.decode_positions(self.position_offsets[self.index], self.frequencies[self.index])
+
+
+def phrase_intersect(lists):
+    if not lists:
+        return EMPTY
+    order = sorted(range(len(lists)), key=lambda i: lists[i].doc_count)
+    cursors = [Cursor(postings) for postings in lists]
+    builder = _Builder()
+    for doc in lists[order[0]].docs():
+        starts = None
+        for i in order:
+            found = cursors[i].seek(doc)
+            if found is None:
+                return builder.build()
+            if found != doc:
+                starts = None
+                break
+            shifted = {position - i for position in cursors[i].positions()}
+            starts = shifted if starts is None else starts & shifted
+            if not starts:
+                break
+        if starts:
+            builder.add(doc, sorted(starts))
+    return builder.build()
+
+
+# Smallest window holding a match of every list, found with a sliding window
+# over all matches in position order. Returns the chosen start positions.
+def _unordered_window(position_lists):
+    events = list(heapq.merge(*([(position, i) for position in positions] for i, positions in enumerate(position_lists))))
+    counts = [0] * len(position_lists)
+    missing = len(position_lists)
+    best = None
+    left = 0
+    for right, (position, i) in enumerate(events):
+        if counts[i] == 0:
+            missing -= 1
+        counts[i] += 1
+        while missing == 0:
+            start, j = events[left]
+            if best is None or position - start < best[0]:
+                best = (position - start, left, right)
+            counts[j] -= 1
+            if counts[j] == 0:
+                missing += 1
+            left += 1
+    if best is None:
+        return None
+    chosen = {}
+    for position, i in events[best[1]:best[2] + 1]:
+        chosen.setdefault(i, position)
+    return sorted(chosen.values())
+
+
+# Smallest window with the matches in list order, each starting after the
+# previous one ends. For every start the earliest following matches are
+# taken; they only move forward as the start does, so every list is read once.
+def _ordered_window(position_lists, lengths):
+    pointers = [0] * len(position_lists)
+    best = None
+    for start in position_lists[0]:
+        chosen = [start]
+        for i in range(1, len(position_lists)):
+            positions = position_lists[i]
+            minimum = chosen[-1] + lengths[i - 1]
+            pointer = pointers[i]
+            while pointer < len(positions) and positions[pointer] < minimum:
+                pointer += 1
+            pointers[i] = pointer
+            if pointer == len(positions):
+                return best
+            chosen.append(positions[pointer])
+        if best is None or chosen[-1] - start < best[-1] - best[0]:
+            best = chosen
+    return best
+
+
+# Pages where every list has a match within `distance` words of the others.
+# Each page keeps the start positions of its tightest window, so the window's
+# span is positions[-1] - positions[0].
+def near_intersect(lists, distance, ordered=False, lengths=None):
+    if not lists:
+        return EMPTY
+    lengths = lengths or [1] * len(lists)
+    order = sorted(range(len(lists)), key=lambda i: lists[i].doc_count)
+    cursors = [Cursor(postings) for postings in lists]
+    builder = _Builder()
+    for doc in lists[order[0]].docs():
+        for i in order:
+            found = cursors[i].seek(doc)
+            if found is None:
+                return builder.build()
+            if found != doc:
+                break
+        else:
+            position_lists = [cursor.positions() for cursor in cursors]
+            window = _ordered_window(position_lists, lengths) if ordered else _unordered_window(position_lists)
+            if window is not None and window[-1] - window[0] <= distance:
+                builder.add(doc, window)
+    return builder.build()
+
+
+# k-way merge of any number of posting lists through a heap of their
+# iterators, instead of len(lists) - 1 pairwise unions.
+def union_all(lists):
+    lists = [postings for postings in lists if postings]
+    if not lists:
+        return EMPTY
+    if len(lists) == 1:
+        return lists[0]
+    builder = _Builder()
+    doc = None
+    positions = []
+    for item_doc, item_positions in heapq.merge(*(postings.items() for postings in lists), key=lambda item: item[0]):
+        if item_doc != doc:
+            if doc is not None:
+                builder.add(doc, sorted(set(positions)))
+            doc = item_doc
+            positions = []
+        positions.extend(item_positions)
+    builder.add(doc, sorted(set(positions)))
+    return builder.build()
+
+
+EMPTY = PostingList()
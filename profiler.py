@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullTrace:
+    def stage(self, name):
+        return NULL_STAGE
+
+    def count(self, name, amount=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = _NullStage()
+NULL_TRACE = NullTrace()
+_current = ContextVar("trace", default=NULL_TRACE)
+
+
+def current():
+    return _current.get()
+
+
+class _Stage:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.trace.stack.append([self.name, time.perf_counter(), 0.0])
+        return self
+
+    def __exit__(self, *exc):
+        name, start, children = self.trace.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.trace.stages[name] += elapsed - children
+        if self.trace.stack:
+            self.trace.stack[-1][2] += elapsed
+        return False
+
+
+# Timings and counters for one query. Stage times are exclusive: time spent
+# in a nested stage (an index lookup inside a boolean merge, say) is only
+# counted once, under the innermost stage, so the stages add up to the total.
+class Trace:
+    def __init__(self, query):
+        self.query = query
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.stack = []
+        self.start = time.perf_counter()
+        self.total = 0.0
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def __enter__(self):
+        self.token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.total = time.perf_counter() - self.start
+        _current.reset(self.token)
+        return False
+
+    def __str__(self):
+        lines = [f"Profile of {self.query!r}: {self.total * 1000:.2f}ms"]
+        for name, seconds in sorted(self.stages.items(), key=lambda stage: -stage[1]):
+            share = seconds / self.total * 100 if self.total else 0.0
+            lines.append(f"  {name:<12}{seconds * 1000:>9.3f}ms {share:>5.1f}%")
+        other = self.total - sum(self.stages.values())
+        if self.total:
+            lines.append(f"  {'other':<12}{other * 1000:>9.3f}ms {other / self.total * 100:>5.1f}%")
+        if self.counters:
+            lines.append("  " + ", ".join(f"{name} {value}" for name, value in sorted(self.counters.items())))
+        return "\n".join(lines)
+
+
+# Collects traces into cumulative per-stage times and counters. When it is
+# disabled every query gets the shared NULL_TRACE, whose hooks do nothing.
+class Profiler:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.seconds = 0.0
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    def trace(self, query):
+        if not self.enabled:
+            return NULL_TRACE
+        return Trace(query)
+
+    def record(self, trace):
+        if not isinstance(trace, Trace):
+            return
+        with self.lock:
+            self.queries += 1
+            self.seconds += trace.total
+            for name, seconds in trace.stages.items():
+                self.stages[name] += seconds
+            for name, value in trace.counters.items():
+                self.counters[name] += value
+
+    def record_stage(self, name, seconds, **counters):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.stages[name] += seconds
+            for counter, value in counters.items():
+                self.counters[counter] += value
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queries": self.queries,
+                "seconds": self.seconds,
+                "stages": dict(self.stages),
+                "counters": dict(self.counters),
+            }
+
+    def dump(self, path):
+        with open(path, "w") as file:
+            json.dump(self.stats(), file, indent=2)
+
+    def __str__(self):
+        stats = self.stats()
+        lines = [f"Profile of {stats['queries']} queries: {stats['seconds'] * 1000:.1f}ms"]
+        for name, seconds in sorted(stats["stages"].items(), key=lambda stage: -stage[1]):
+            lines.append(f"  {name:<12}{seconds * 1000:>9.1f}ms")
+        if stats["counters"]:
+            lines.append("  " + ", ".join(f"{name} {value}" for name, value in sorted(stats["counters"].items())))
+        return "\n".join(lines)
+
@@ -0,0 +1,204 @@
+import re
+from consts import calculate_priority
+from tokenizer import Tokenizer
+
+
+class Node:
+    def leaves(self):
+        yield self
+
+    def positive_leaves(self):
+        yield self
+
+    def __repr__(self):
+        return self.key()
+
+
+class Term(Node):
+    def __init__(self, word):
+        self.word = word
+
+    def key(self):
+        return self.word
+
+
+class Wildcard(Node):
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def key(self):
+        return self.pattern
+
+
+class Phrase(Node):
+    def __init__(self, words):
+        self.words = words
+
+    def key(self):
+        return f'"{" ".join(self.words)}"'
+
+
+# Every child matches within `distance` words of the others: the first and
+# last match start at most `distance` words apart. Ordered (ONEAR) children
+# must also appear in the given order without overlapping.
+class Near(Node):
+    def __init__(self, children, distance, ordered=False):
+        self.children = children
+        self.distance = distance
+        self.ordered = ordered
+
+    @property
+    def operator(self):
+        return "ONEAR" if self.ordered else "NEAR"
+
+    def leaves(self):
+        for child in self.children:
+            yield from child.leaves()
+
+    def positive_leaves(self):
+        yield from self.leaves()
+
+    def key(self):
+        keys = [child.key() for child in self.children]
+        if not self.ordered:
+            keys.sort()
+        return "(" + f" {self.operator}/{self.distance} ".join(keys) + ")"
+
+
+class Not(Node):
+    def __init__(self, child):
+        self.child = child
+
+    def leaves(self):
+        yield from self.child.leaves()
+
+    def positive_leaves(self):
+        return iter(())
+
+    def key(self):
+        return f"NOT {self.child.key()}"
+
+
+class And(Node):
+    operator = "AND"
+
+    def __init__(self, children):
+        self.children = children
+
+    def leaves(self):
+        for child in self.children:
+            yield from child.leaves()
+
+    def positive_leaves(self):
+        for child in self.children:
+            yield from child.positive_leaves()
+
+    def key(self):
+        return "(" + f" {self.operator} ".join(sorted(child.key() for child in self.children)) + ")"
+
+
+class Or(And):
+    operator = "OR"
+
+
+def split_words(text):
+    return [word for word in re.split(r'\W+', text.lower()) if word]
+
+
+class Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise RuntimeError('Missing term at the end of the query')
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            return None
+        node = self.expression(1)
+        if self.peek() is not None:
+            raise RuntimeError(f'Unexpected {self.peek().value}')
+        return node
+
+    def expression(self, min_priority):
+        left = self.unary()
+        while True:
+            token = self.peek()
+            if token is None or token.type not in ('AND', 'OR', 'NOT', 'NEAR', 'ONEAR'):
+                return left
+            priority = calculate_priority(token.type)
+            if priority < min_priority:
+                return left
+            self.position += 1
+            right = self.expression(priority + 1)
+            if token.type in ('NEAR', 'ONEAR'):
+                left = self.near(token, left, right)
+            else:
+                left = self.combine(token.type, left, right)
+
+    def unary(self):
+        token = self.next()
+        if token.type == 'NOT':
+            return Not(self.unary())
+        if token.type == 'LPAREN':
+            node = self.expression(1)
+            if self.peek() is None or self.peek().type != 'RPAREN':
+                raise RuntimeError('Missing closing parenthesis')
+            self.position += 1
+            return node
+        if token.type == 'TERM':
+            if '*' in token.value:
+                parts = token.value.lower().split('*')
+                if not any(parts) or not all(re.fullmatch(r'\w*', part) for part in parts):
+                    raise RuntimeError(f'Invalid wildcard {token.value}')
+                return Wildcard(token.value.lower())
+            words = split_words(token.value)
+            if len(words) == 1:
+                return Term(words[0])
+            if words:
+                return Phrase(words)
+        if token.type == 'PHRASE':
+            words = split_words(token.value.strip('"'))
+            if words:
+                return Phrase(words)
+        raise RuntimeError(f'Unexpected {token.value}')
+
+    def near(self, token, left, right):
+        distance = int(token.value.split('/')[1])
+        ordered = token.type == 'ONEAR'
+        children = []
+        for child in (left, right):
+            if type(child) is Near and child.distance == distance and child.ordered == ordered:
+                children.extend(child.children)
+            elif isinstance(child, (Term, Phrase, Wildcard)):
+                children.append(child)
+            else:
+                raise RuntimeError(f'{token.value} can only join terms, phrases and wildcards')
+        return Near(children, distance, ordered)
+
+    def combine(self, operator, left, right):
+        if operator == 'NOT':
+            right = Not(right)
+            operator = 'AND'
+        node_type = And if operator == 'AND' else Or
+        children = []
+        for child in (left, right):
+            if type(child) is node_type:
+                children.extend(child.children)
+            else:
+                children.append(child)
+        return node_type(children)
+
+
+def parse_query(text):
+    return Parser(Tokenizer(text).tokenize()).parse()
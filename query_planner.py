@@ -0,0 +1,200 @@
+from query import Term, Wildcard, Phrase, Near, Not, And, Or
+from postings import PostingList, phrase_intersect, near_intersect, union_all
+from profiler import current
+
+
+class Plan:
+    def __init__(self, operation, node=None, children=(), estimate=0):
+        self.operation = operation
+        self.node = node
+        self.children = list(children)
+        self.estimate = estimate
+        self.actual = None
+        self.result = None
+        self.skipped = False
+        self.cached = False
+        self.expansions = []
+
+    def key(self):
+        if self.is_leaf():
+            return self.node.key()
+        if self.operation == "ALL":
+            return "*"
+        if self.is_proximity():
+            keys = [child.key() for child in self.children]
+            if self.operation == "NEAR":
+                keys.sort()
+            return "(" + f" {self.operation}/{self.node.distance} ".join(keys) + ")"
+        if self.operation == "DIFFERENCE":
+            excluded = sorted(f"NOT {child.key()}" for child in self.children[1:])
+            return f"({self.children[0].key()} {' '.join(excluded)})"
+        return "(" + f" {self.operation} ".join(sorted(child.key() for child in self.children)) + ")"
+
+    def is_leaf(self):
+        return self.operation in ("TERM", "PHRASE", "WILDCARD")
+
+    def is_proximity(self):
+        return self.operation in ("NEAR", "ONEAR")
+
+    def is_disjunction(self):
+        if self.operation == "OR":
+            return all(child.is_disjunction() for child in self.children)
+        return self.is_leaf()
+
+    # Whether every page the plan matches contains one of its positive
+    # leaves, so walking the leaves' postings reaches every result.
+    def is_covered(self):
+        if self.is_leaf() or self.is_proximity():
+            return True
+        if self.operation == "ALL":
+            return False
+        if self.operation == "OR":
+            return all(child.is_covered() for child in self.children)
+        if self.operation == "AND":
+            return any(child.is_covered() for child in self.children)
+        return self.children[0].is_covered()
+
+    def positive_leaves(self):
+        if self.is_leaf():
+            yield self
+        elif self.operation == "DIFFERENCE":
+            yield from self.children[0].positive_leaves()
+        else:
+            for child in self.children:
+                yield from child.positive_leaves()
+
+    def proximity(self):
+        if self.is_proximity():
+            yield self
+        elif self.operation == "DIFFERENCE":
+            yield from self.children[0].proximity()
+        else:
+            for child in self.children:
+                yield from child.proximity()
+
+    def label(self):
+        if self.operation == "WILDCARD":
+            words = ", ".join(word for word, _ in self.expansions[:5])
+            more = f", ... {len(self.expansions)} terms" if len(self.expansions) > 5 else ""
+            return f"{self.operation} {self.node.key()} ({words}{more})"
+        if self.is_leaf():
+            return f"{self.operation} {self.node.key()}"
+        if self.is_proximity():
+            return f"{self.operation}/{self.node.distance}"
+        return self.operation
+
+
+class QueryPlanner:
+    def __init__(self, index, cache=None):
+        self.index = index
+        self.cache = cache
+
+    def num_pages(self):
+        return len(self.index.page_lengths)
+
+    def plan(self, node):
+        if isinstance(node, Term):
+            return Plan("TERM", node, estimate=self.index.document_frequency(node.word))
+        if isinstance(node, Phrase):
+            return Plan("PHRASE", node, estimate=min(self.index.document_frequency(word) for word in node.words))
+        if isinstance(node, Wildcard):
+            plan = Plan("WILDCARD", node)
+            with current().stage("lookup"):
+                plan.expansions = self.index.expand(node.pattern)
+            plan.estimate = min(sum(frequency for _, frequency in plan.expansions), self.num_pages())
+            return plan
+        if isinstance(node, Near):
+            children = [self.plan(child) for child in node.children]
+            return Plan(node.operator, node, children, min(child.estimate for child in children))
+        if isinstance(node, Not):
+            return self.plan(And([node]))
+        if isinstance(node, Or):
+            children = sorted((self.plan(child) for child in node.children), key=lambda child: child.estimate)
+            return Plan("OR", node, children, min(sum(child.estimate for child in children), self.num_pages()))
+
+        positive = sorted((self.plan(child) for child in node.children if not isinstance(child, Not)), key=lambda child: child.estimate)
+        negative = sorted((self.plan(child.child) for child in node.children if isinstance(child, Not)), key=lambda child: -child.estimate)
+        if not positive:
+            positive = [Plan("ALL", estimate=self.num_pages())]
+        base = positive[0]
+        if len(positive) > 1:
+            base = Plan("AND", node, positive, positive[0].estimate)
+        if not negative:
+            return base
+        estimate = base.estimate
+        if base.operation == "ALL":
+            estimate = max(base.estimate - negative[0].estimate, 0)
+        return Plan("DIFFERENCE", node, [base] + negative, estimate)
+
+    def execute(self, plan):
+        if plan.result is not None:
+            return plan.result
+        trace = current()
+        if self.cache is not None:
+            result = self.cache.get(plan.key())
+            if result is not None:
+                plan.result = result
+                plan.actual = result.doc_count
+                plan.cached = True
+                trace.count("cache_hits")
+                return result
+        if plan.is_leaf():
+            if plan.operation == "WILDCARD":
+                words = [word for word, _ in plan.expansions]
+            elif plan.operation == "PHRASE":
+                words = plan.node.words
+            else:
+                words = [plan.node.word]
+            with trace.stage("lookup"):
+                lists = [self.index.search(word) for word in words]
+            trace.count("postings_scanned", sum(postings.doc_count for postings in lists))
+            if plan.operation == "TERM":
+                result = lists[0]
+            elif plan.operation == "PHRASE":
+                with trace.stage("phrase"):
+                    result = phrase_intersect(lists)
+            else:
+                with trace.stage("merge"):
+                    result = union_all(lists)
+        elif plan.operation == "ALL":
+            result = PostingList.from_items((page, []) for page in sorted(self.index.page_lengths))
+        elif plan.operation == "OR":
+            lists = [self.execute(child) for child in plan.children]
+            with trace.stage("merge"):
+                result = union_all(lists)
+        elif plan.is_proximity():
+            lists = [self.execute(child) for child in plan.children]
+            lengths = [len(child.node.words) if child.operation == "PHRASE" else 1 for child in plan.children]
+            with trace.stage("proximity"):
+                result = near_intersect(lists, plan.node.distance, plan.operation == "ONEAR", lengths)
+        else:
+            result = self.execute(plan.children[0])
+            for child in plan.children[1:]:
+                if not result:
+                    child.skipped = True
+                    continue
+                other = self.execute(child)
+                with trace.stage("merge"):
+                    if plan.operation == "AND":
+                        result = result.intersect(other)
+                    else:
+                        result = result.difference(other)
+        plan.result = result
+        plan.actual = result.doc_count
+        if self.cache is not None:
+            self.cache.put(plan.key(), result, result.nbytes())
+        return result
+
+    def explain(self, plan, depth=0):
+        if plan.skipped:
+            actual = "skipped"
+        elif plan.actual is None:
+            actual = "not executed"
+        else:
+            actual = f"actual {plan.actual}"
+        if plan.cached:
+            actual += ", cached"
+        lines = [f"{'  ' * depth}{plan.label()} (estimated {plan.estimate}, {actual})"]
+        for child in plan.children:
+            lines.append(self.explain(child, depth + 1))
+        return "\n".join(lines)
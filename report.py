@@ -0,0 +1,102 @@
+import fitz
+import os
+import queue
+import threading
+import time
+from consts import RESULTS, EXPORT, REPORT_QUEUE_SIZE
+from pdf_parser import PDFHandler
+
+
+# Renders search_results.pdf on a background thread. Every submitted report
+# gets a new generation number; a report whose generation is no longer the
+# latest is dropped from the queue or abandoned between entries, so only the
+# newest query is ever saved. With a source document, the matches are also
+# highlighted on its original pages and saved to export_path.
+class ReportWriter:
+    def __init__(self, output_path=RESULTS, source_path=None, export_path=EXPORT, queue_size=REPORT_QUEUE_SIZE, profiler=None):
+        self.output_path = output_path
+        self.source_path = source_path
+        self.export_path = export_path
+        self.profiler = profiler
+        self.pdf_handler = PDFHandler(output_path)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.written = 0
+        self.cancelled = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, entries, highlights=None):
+        with self.lock:
+            self.generation += 1
+            job = (self.generation, entries, highlights)
+            while True:
+                try:
+                    self.queue.put_nowait(job)
+                    return job[0]
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.cancelled += 1
+                    except queue.Empty:
+                        pass
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+
+    def is_stale(self, generation):
+        return generation != self.generation
+
+    def run(self):
+        while True:
+            generation, entries, highlights = self.queue.get()
+            if entries is None:
+                return
+            if self.is_stale(generation):
+                self.cancelled += 1
+                continue
+            try:
+                if self.render(generation, entries) and highlights and self.source_path is not None:
+                    self.export(generation, highlights)
+            except Exception as e:
+                self.error = e
+
+    def record(self, name, start, path):
+        if self.profiler is not None:
+            self.profiler.record_stage(name, time.perf_counter() - start, bytes_written=os.path.getsize(path))
+
+    def render(self, generation, entries):
+        start = time.perf_counter()
+        doc = self.pdf_handler.create_initial_pdf()
+        try:
+            finished = self.pdf_handler.add_text(doc, entries, cancelled=lambda: self.is_stale(generation))
+            if not finished or self.is_stale(generation):
+                self.cancelled += 1
+                return False
+            self.pdf_handler.save_pdf(doc, self.output_path)
+            self.written += 1
+            self.record("report", start, self.output_path)
+            return True
+        finally:
+            doc.close()
+
+    def export(self, generation, highlights):
+        start = time.perf_counter()
+        doc = fitz.open(self.source_path)
+        try:
+            self.pdf_handler.highlight_pages(doc, highlights)
+            if self.is_stale(generation):
+                self.cancelled += 1
+                return False
+            self.pdf_handler.save_pdf(doc, self.export_path)
+            self.record("export", start, self.export_path)
+            return True
+        finally:
+            doc.close()
+
+    def close(self):
+        self.queue.put((None, None, None))
+        self.thread.join()
@@ -0,0 +1,134 @@
+import heapq
+import math
+from itertools import accumulate
+from consts import BM25_K1, BM25_B, PAGE_RANK_WEIGHT, PROXIMITY_WEIGHT
+from postings import Cursor
+from profiler import current
+
+
+class BM25:
+    def __init__(self, page_lengths, page_rank=None, k1=BM25_K1, b=BM25_B, page_rank_weight=PAGE_RANK_WEIGHT, proximity_weight=PROXIMITY_WEIGHT,
+                 num_pages=None, average_length=None):
+        # A shard scores its own pages with the collection-wide page count
+        # and average length, so its scores compare with other shards'.
+        self.page_lengths = page_lengths
+        self.num_pages = num_pages or max(len(page_lengths), 1)
+        self.average_length = average_length or sum(page_lengths.values()) / max(len(page_lengths), 1) or 1.0
+        self.k1 = k1
+        self.b = b
+        self.rank = page_rank.rank if page_rank is not None else {}
+        self.page_rank_weight = page_rank_weight
+        self.proximity_weight = proximity_weight
+        self.max_prior = max((self.prior(page) for page in self.rank), default=0.0)
+
+    def idf(self, document_frequency):
+        return math.log(1 + (self.num_pages - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def term_score(self, frequency, page, idf):
+        length = self.page_lengths.get(page, self.average_length)
+        norm = self.k1 * (1 - self.b + self.b * length / self.average_length)
+        return idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+    def upper_bound(self, idf):
+        return idf * (self.k1 + 1)
+
+    def prior(self, page):
+        return self.page_rank_weight * math.log1p(self.rank.get(page, 0.0) * self.num_pages)
+
+    # NEAR results keep the positions of each page's tightest window, so a
+    # window of span s adds proximity_weight / (1 + s) to the page's score.
+    def proximity(self, page, cursors):
+        bonus = 0.0
+        for cursor in cursors:
+            if cursor.seek(page) == page:
+                positions = cursor.positions()
+                bonus += self.proximity_weight / (1 + positions[-1] - positions[0])
+        return bonus
+
+    # MaxScore: terms are ordered by their score upper bound. Once the k-th best
+    # score exceeds what the lowest-bound terms could add together, those terms
+    # stop producing candidates and are only probed for pages that can still
+    # enter the heap.
+    # `frequencies`, if given, are the document frequencies to use for the
+    # idf of each list instead of its own length (collection-wide ones when
+    # the lists come from a shard).
+    # `covered` says every candidate contains at least one of the terms. When
+    # it does not (an OR with a negated branch), pages without any term would
+    # never come up from the term lists, so every candidate is scored instead.
+    def top_k(self, term_postings, k, candidates=None, proximity=(), frequencies=None, covered=True):
+        terms = []
+        for i, postings in enumerate(term_postings):
+            if postings:
+                idf = self.idf(frequencies[i] if frequencies is not None else postings.doc_count)
+                terms.append((self.upper_bound(idf), idf, Cursor(postings)))
+        proximity = [Cursor(postings) for postings in proximity if postings]
+        if not terms or not covered:
+            if candidates is None:
+                return []
+            return self.score_candidates(terms, k, candidates, proximity)
+        max_prior = self.max_prior + self.proximity_weight * len(proximity)
+        terms.sort(key=lambda term: term[0])
+        bounds = list(accumulate(term[0] for term in terms))
+        for _, _, cursor in terms:
+            cursor.seek(0)
+        candidate_cursor = Cursor(candidates) if candidates is not None else None
+
+        heap = []
+        threshold = float("-inf")
+        essential = 0
+        scored = 0
+        while essential < len(terms):
+            docs = [cursor.doc for _, _, cursor in terms[essential:] if cursor.doc is not None]
+            if not docs:
+                break
+            doc = min(docs)
+            if candidate_cursor is not None:
+                candidate = candidate_cursor.seek(doc)
+                if candidate is None:
+                    break
+                if candidate != doc:
+                    for _, _, cursor in terms[essential:]:
+                        if cursor.doc is not None and cursor.doc < candidate:
+                            cursor.seek(candidate)
+                    continue
+
+            scored += 1
+            score = self.prior(doc) + self.proximity(doc, proximity)
+            for _, idf, cursor in terms[essential:]:
+                if cursor.doc == doc:
+                    score += self.term_score(cursor.frequency(), doc, idf)
+                    cursor.next()
+            for i in range(essential - 1, -1, -1):
+                if score + bounds[i] < threshold:
+                    break
+                _, idf, cursor = terms[i]
+                if cursor.seek(doc) == doc:
+                    score += self.term_score(cursor.frequency(), doc, idf)
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -doc))
+            elif (score, -doc) > heap[0]:
+                heapq.heapreplace(heap, (score, -doc))
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while essential < len(terms) and bounds[essential] + max_prior < threshold:
+                    essential += 1
+
+        current().count("pages_scored", scored)
+        return [(-doc, score) for score, doc in sorted(heap, reverse=True)]
+
+    def score_candidates(self, terms, k, candidates, proximity):
+        heap = []
+        scored = 0
+        for doc in candidates.docs():
+            scored += 1
+            score = self.prior(doc) + self.proximity(doc, proximity)
+            for _, idf, cursor in terms:
+                if cursor.seek(doc) == doc:
+                    score += self.term_score(cursor.frequency(), doc, idf)
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -doc))
+            elif (score, -doc) > heap[0]:
+                heapq.heapreplace(heap, (score, -doc))
+        current().count("pages_scored", scored)
+        return [(-doc, score) for score, doc in sorted(heap, reverse=True)]
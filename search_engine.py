@@ -1,205 +1,293 @@
-import re
-from collections import defaultdict
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from page_rank import PageRank
 from consts import *
-from pdf_parser import PDFHandler
-import os
+from report import ReportWriter
+from scoring import BM25
+from query import parse_query
+from query_planner import QueryPlanner
+from cache import QueryCache
+from snippets import make_snippet
+from pdf_parser import did_you_mean
+from spelling import SpellingIndex
+from profiler import Profiler, current
 
-class SearchEngine:
-    def __init__(self, trie, pages_text, graph):
+pinned = ContextVar("pinned", default=None)
+
+
+# Everything a query reads from one index snapshot, with the scorer, planner
+# and caches built on it. A reload replaces the whole state at once; the old
+# state's files are closed once the last query pinning it has finished.
+class IndexState:
+    def __init__(self, trie, pages_text, graph, spans, boxes=None, statistics=None, name=None, spelling=None, spelling_path=None):
+        self.name = name
+        self._spelling = spelling
+        self.spelling_path = spelling_path
+        self.spelling_lock = threading.Lock()
         self.trie = trie
-        self.page_rank = None
         self.pages_text = pages_text
-        self.pdf_handler = PDFHandler(RESULTS)
+        self.spans = spans
+        self.boxes = boxes
         self.page_rank = graph
+        self.page_label = getattr(pages_text, "label", str)
+        self.statistics = statistics or {}
+        self.scorer = BM25(trie.page_lengths, graph, **self.statistics)
+        self.cache = QueryCache(getattr(trie, "version", None))
+        self.planner = QueryPlanner(trie, self.cache.postings)
+        self.users = 0
+        self.retired = False
+
+    # The spelling index is by far the slowest file to load and only needed
+    # for did-you-mean, so it is read on first use unless already loaded.
+    @property
+    def spelling(self):
+        if self._spelling is None and self.spelling_path is not None:
+            with self.spelling_lock:
+                if self._spelling is None:
+                    self._spelling = SpellingIndex.load(self.spelling_path)
+        return self._spelling
+
+    # A corpus changes in place rather than through snapshots: when its
+    # version moves on, the caches are dropped and its pages rescored.
+    def validate(self):
+        if self.cache.validate():
+            self.page_rank = getattr(self.trie, "page_rank", self.page_rank)
+            self.scorer = BM25(self.trie.page_lengths, self.page_rank, **self.statistics)
+
+    def close(self):
+        for store in (self.trie, self.pages_text, self.spans, self.boxes):
+            if store is not None:
+                store.close()
+
+
+class SearchEngine:
+    def __init__(self, trie, pages_text, graph, spans, ranking="bm25", explain=False, boxes=None, source=None, report=True, profile=False, statistics=None,
+                 snapshots=None, spelling_path=None):
+        self.snapshots = snapshots
+        self.state = IndexState(trie, pages_text, graph, spans, boxes, statistics, snapshots.name if snapshots is not None else None,
+                                spelling_path=spelling_path)
+        self.reloads = 0
+        self.lock = threading.Lock()
+        self.profiler = Profiler(profile)
+        self.report = ReportWriter(RESULTS, source if boxes is not None else None, profiler=self.profiler) if report else None
+        self.ranking = ranking
+        self.explain = explain
+
+    # The index attributes (trie, planner, cache, ...) come from the state the
+    # running query pinned, so a reload in between never mixes two snapshots
+    # within one query; outside a query they are the latest state's.
+    def __getattr__(self, name):
+        if name in ("state", "lock"):
+            raise AttributeError(name)
+        state = pinned.get()
+        return getattr(state if state is not None else self.state, name)
+
+    # Switches to a snapshot the watcher has finished loading. In-flight
+    # queries keep the state they pinned and finish on the old snapshot.
+    def refresh(self):
+        if self.snapshots is None:
+            return
+        self.snapshots.start()
+        snapshot = self.snapshots.take()
+        if snapshot is not None:
+            name, parts = snapshot
+            state = IndexState(**parts, name=name)
+            with self.lock:
+                self.state, old = state, self.state
+                old.retired = True
+                if old.users == 0:
+                    old.close()
+            self.reloads += 1
+
+    @contextmanager
+    def pin(self):
+        if pinned.get() is not None:
+            yield
+            return
+        self.refresh()
+        with self.lock:
+            state = self.state
+            state.users += 1
+        token = pinned.set(state)
+        try:
+            yield
+        finally:
+            pinned.reset(token)
+            with self.lock:
+                state.users -= 1
+                if state.retired and state.users == 0:
+                    state.close()
+
+    def search(self, query):
+        with self.pin():
+            with self.profiler.trace(query) as trace:
+                plan, res = self.query(query)
+                if plan is not None:
+                    leaves = list(plan.positive_leaves())
+                    for page_num, _ in res['combined'][:RESULTS_PAGE_SIZE]:
+                        self.snippet(page_num, leaves)
+            self.profiler.record(trace)
+            if plan is None:
+                return {}
+
+            if self.explain:
+                print(self.planner.explain(plan) + "\n")
+            if self.profiler.enabled:
+                print(f"{trace}\n")
 
-    def search(self, terms, operations):
-        if not terms:
-            return {}
-        
+            self.display_results(res, leaves)
+
+    def query(self, query):
+        trace = current()
+        with trace.stage("parse"):
+            tree = parse_query(query)
+        if tree is None:
+            return None, {}
+
+        self.validate()
         res = {}
-        term_results = []
-        phrase = False
-        prefix = False
-        
-        for term in terms:
-            if term[1] == 'PREFIX':
-                prefix = True
-                positions = self.trie.starts_with(term[0])
-                sorted_positions = sorted(positions, key=lambda x: len(x[0]))
-                for p in sorted_positions:
-                    print(p[0])
-                continue
-
-            elif term[1] == 'PHRASE':
-                phrase = True
-
-            results = defaultdict(list)
-            positions = self.trie.search(term[0])
-            if not positions:
-                term_results.append((term[0], []))
-                continue
-            for data in positions:
-                results[data[0]].append(data[1])
-            sorted_results = sorted(results.items(), key=lambda item: (len(item[1]), self.page_rank.rank.get(item[0], 0)), reverse=True)
-            term_results.append((term[0], sorted_results))
-
-        if not term_results:
-            return res
-
-        combined_results = term_results[0][1]
-        for i in range(1, len(term_results)):
-            op = operations[i-1]
-            next_results = term_results[i][1]
-
-            if op == '2':  # AND operation
-                combined_results = self.and_operation(combined_results, next_results)
-            elif op == '1':  # OR operation
-                combined_results = self.or_operation(combined_results, next_results)
-            elif op == '3':  # NOT operation
-                combined_results = self.not_operation(combined_results, next_results)
-
-        if phrase:
-            combined_results = self.phrase_search(combined_results, terms)
-        
-        res['combined'] = combined_results
-        
-        if prefix:
-            return {}
-        
-        self.display_results(res, " ".join(term[0] for term in terms), phrase)
-    
-    def phrase_search(self, combined_results, terms):
-        final_results = []
-        term_words = [term[0] for term in terms]
-        phrase_length = len(term_words)
-
-        for page, positions in combined_results:
-            text = self.pages_text[page].lower()
-            words = re.findall(r'\b\w+\b', text)
-            phrase_positions = []
-            
-            for pos in positions:
-                if pos + phrase_length > len(words):
-                    continue  
-                if all(words[pos + i] == term_words[i] for i in range(phrase_length)):
-                    phrase_positions.append(pos)
-                    
-            if phrase_positions:
-                final_results.append((page, phrase_positions))
-                
-        return final_results
-
-    def and_operation(self, results1, results2):
-        result_dict = defaultdict(list)
-        set_results2 = {doc for doc, _ in results2}
-        for doc, pos in results1:
-            if doc in set_results2:
-                result_dict[doc].extend(pos)
-        return sorted(result_dict.items(), key=lambda item: (len(item[1]), self.page_rank.rank.get(item[0], 0)), reverse=True)
-
-    def or_operation(self, results1, results2):
-        result_dict = defaultdict(lambda: {'positions': [], 'count': 0})
-        for doc, pos in results1:
-            result_dict[doc]['positions'].extend(pos)
-            result_dict[doc]['count'] += 1
-        for doc, pos in results2:
-            result_dict[doc]['positions'].extend(pos)
-            result_dict[doc]['count'] += 1
-
-        sorted_results = sorted(result_dict.items(), key=lambda item: (item[1]['count'], len(item[1]['positions']), self.page_rank.rank.get(item[0], 0)), reverse=True)
-        return [(doc, info['positions']) for doc, info in sorted_results]
-
-    def not_operation(self, results1, results2):
-        result_dict = defaultdict(list)
-        set_results2 = {doc for doc, _ in results2}
-        for doc, pos in results1:
-            if doc not in set_results2:
-                result_dict[doc].extend(pos)
-        return sorted(result_dict.items(), key=lambda item: (len(item[1]), self.page_rank.rank.get(item[0], 0)), reverse=True)
-
-    def display_results(self, results, query, phrase):
+        with trace.stage("plan"):
+            plan = self.planner.plan(tree)
+        if self.ranking == "bm25":
+            res['more'] = lambda k: self.top_k(plan, k)
+            res['combined'] = res['more'](RESULTS_PAGE_SIZE)
+        else:
+            key = (plan.key(), self.ranking)
+            res['combined'] = self.cache.results.get(key)
+            if res['combined'] is None:
+                items = self.planner.execute(plan).items()
+                with trace.stage("rank"):
+                    res['combined'] = self.rank_results(items)
+                self.cache.results.put(key, res['combined'], 64 * len(res['combined']))
+        trace.count("candidates", len(res["combined"]))
+        return plan, res
+
+    # One page of results as (page, score, snippet) triples, plus whether
+    # there are more. The frequency ranking scores pages by their hit count.
+    # Without snippets the third item is None and no page text is read.
+    # `missing` collects shards that did not answer; a single index has none.
+    def results_page(self, query, page=1, size=RESULTS_PAGE_SIZE, snippets=True, missing=None):
+        with self.pin(), self.profiler.trace(query) as trace:
+            plan, res = self.query(query)
+            entries = []
+            results = []
+            end = page * size
+            if plan is not None:
+                results = res['more'](end + 1) if 'more' in res else res['combined']
+                leaves = list(plan.positive_leaves())
+                for page_num, score in results[end - size:end]:
+                    if not isinstance(score, float):
+                        score = len(score)
+                    entries.append((page_num, score, self.snippet(page_num, leaves) if snippets else None))
+        self.profiler.record(trace)
+        return entries, len(results) > end
+
+    def top_k(self, plan, k, frequencies=None):
+        key = (plan.key(), self.ranking, k, tuple(sorted(frequencies.items())) if frequencies else None)
+        results = self.cache.results.get(key)
+        if results is None:
+            # The candidates come first so an empty conjunction stops before
+            # any posting list that the planner skipped is read for scoring.
+            candidates = None
+            if not plan.is_disjunction():
+                candidates = self.planner.execute(plan)
+            if candidates is not None and not candidates:
+                results = []
+            else:
+                leaves = list(plan.positive_leaves())
+                positive = [self.planner.execute(leaf) for leaf in leaves]
+                if frequencies:
+                    frequencies = [frequencies.get(leaf.key(), postings.doc_count) for leaf, postings in zip(leaves, positive)]
+                proximity = [self.planner.execute(near) for near in plan.proximity()]
+                with current().stage("rank"):
+                    results = self.scorer.top_k(positive, k, candidates, proximity, frequencies, plan.is_covered())
+            self.cache.results.put(key, results, 64 * len(results))
+        return results
+
+    # Suggestions come from the pinned snapshot's spelling index. A corpus,
+    # passed in as the trie, keeps its own spelling index instead.
+    def did_you_mean(self, query):
+        with self.pin():
+            if self.spelling is None:
+                return self.trie.did_you_mean(query)
+            return did_you_mean(query, self.spelling)
+
+    # Loads what is otherwise read on first use, so a pre-fork server's
+    # workers share it. Unlike a query, this does not start the watcher.
+    def warm(self):
+        if self.state.spelling is None:
+            self.state.trie.did_you_mean("")
+
+    def expand(self, pattern, limit=WILDCARD_EXPANSIONS):
+        with self.pin():
+            return self.trie.expand(pattern, limit)
+
+    def rank_results(self, results):
+        return sorted(results, key=lambda item: (len(item[1]), self.page_rank.rank.get(item[0], 0)), reverse=True)
+
+    def display_results(self, results, leaves):
         if not results['combined']:
+            if self.report is not None:
+                self.report.cancel()
             print("\033[41m\033[1;37m{}\033[0m".format("No results found!"))
             return
 
         combined_results = results['combined']
+        if self.report is not None:
+            top = [page_num for page_num, _ in combined_results[:10]]
+            self.report.submit([
+                (f"Rank: {rank}, Page: {self.page_label(page_num)}", self.snippet(page_num, leaves))
+                for rank, page_num in enumerate(top, start=1)
+            ], self.highlights(top, leaves))
 
-        if os.path.exists(RESULTS):
-            os.remove(RESULTS)
-        
-        combined_pdf = self.pdf_handler.create_initial_pdf(RESULTS)
-       
-        try:
-            snippets = []
-            for rank, (page_num, _) in enumerate(combined_results[:10], start=1):
-                snippet = self.get_snippet(page_num, query, phrase)
-                highlighted_snippet = self.highlight_words(snippet, query, phrase)
-                snippet_text = f"Rank: {rank}, Page: {page_num}\n{highlighted_snippet}\n{'-' * 80}"
-                snippets.append(snippet_text)
-            self.pdf_handler.add_text(combined_pdf, snippets)
-            self.pdf_handler.save_pdf(combined_pdf, RESULTS)
-            self.pdf_handler.highlight_text(combined_pdf, query, phrase)
-            self.pdf_handler.save_pdf(combined_pdf, RESULTS)
-            
-        except ValueError as e:
-            print(f"Error: {e}")
-        
-        for rank, (page_num, _) in enumerate(combined_results, start=1):
+        rank = 0
+        while rank < len(combined_results):
+            page_num = combined_results[rank][0]
+            rank += 1
             if rank % 10 == 0:
                 quest = input("\nSee more (y/n): ")
                 print()
                 if quest.lower() != "y":
                     break
-            snippet = self.get_snippet(page_num, query, phrase)
-            highlighted_snippet = self.highlight_words(snippet, query, phrase)
-            print(f"{LIGHT_BLUE}Rank: {rank}, Page: {page_num}{RESET}")
-            print(highlighted_snippet)
+            if rank == len(combined_results) and 'more' in results:
+                combined_results = results['more'](rank + RESULTS_PAGE_SIZE)
+            snippet = self.snippet(page_num, leaves)
+            print(f"{LIGHT_BLUE}Rank: {rank}, Page: {self.page_label(page_num)}{RESET}")
+            print(snippet.highlighted())
             print(f"{ORANGE}{'-' * 92}{RESET}")
 
-    def get_snippet(self, page_num, query, phrase):
-        text = self.pages_text[page_num].lower()
-        text_stripped = re.sub(r'[^\w\s]', '', text)
-        
-        snippets = []
-        snippet_length = 30
-
-        if phrase:
-            phrase_pattern = re.compile(r'\b' + re.escape(query.lower()) + r'\b')
-            phrase_positions = [match.start() for match in phrase_pattern.finditer(text_stripped)]
-
-            for pos in phrase_positions:
-                start = max(0, pos - snippet_length)
-                end = min(len(text_stripped), pos + len(query) + snippet_length)
-                snippet = text_stripped[start:end]
-                if snippet not in snippets:
-                    snippets.append(snippet)
-        else:
-            query_list = re.split(r'\W+', query.lower())
-            query_list = [word for word in query_list if word]
-            data = []
-            
-            for q in query_list:
-                word_positions = [m.start() for m in re.finditer(r'\b' + re.escape(q) + r'\b', text_stripped)]
-                data.extend(word_positions)
-            
-            for pos in sorted(set(data)):
-                start = max(0, pos - snippet_length)
-                end = min(len(text_stripped), pos + len(max(query_list, key=len)) + snippet_length)
-                snippet = text_stripped[start:end]
-                if snippet not in snippets:
-                    snippets.append(snippet)
-        
-        if snippets:
-            return " ... ".join(snippets)
-        return ""
-
-    def highlight_words(self, snippet, query, phrase):
-        if phrase:
-            snippet = re.sub(rf"(?i)\b{re.escape(query)}\b", rf"{GREEN}\g<0>{RESET}", snippet)
-        else:
-            words = re.split(r'\W+', query)
-            words = [word.lower() for word in words if word]
-            for word in words:
-                snippet = re.sub(rf"(?i)\b{re.escape(word)}\b", rf"{GREEN}\g<0>{RESET}", snippet)
-        return snippet
\ No newline at end of file
+    def close(self):
+        if self.snapshots is not None:
+            self.snapshots.close()
+        if self.report is not None:
+            self.report.close()
+
+    def stats(self):
+        stats = {"cache": self.cache.stats()}
+        if self.snapshots is not None:
+            stats["snapshot"] = {"name": self.state.name, "reloads": self.reloads, "failures": self.snapshots.failures}
+        return stats
+
+    def hits(self, page_num, leaves):
+        hits = []
+        for leaf in leaves:
+            length = len(leaf.node.words) if leaf.operation == "PHRASE" else 1
+            hits.extend((position, length) for position in self.planner.execute(leaf).positions(page_num))
+        return hits
+
+    def snippet(self, page_num, leaves):
+        key = (page_num, tuple(leaf.key() for leaf in leaves))
+        snippet = self.cache.snippets.get(key)
+        if snippet is None:
+            trace = current()
+            with trace.stage("snippets"):
+                snippet = make_snippet(self.pages_text[page_num], self.spans[page_num], self.hits(page_num, leaves))
+            trace.count("pages_touched")
+            self.cache.snippets.put(key, snippet, len(snippet))
+        return snippet
+
+    def highlights(self, pages, leaves):
+        if self.boxes is None:
+            return None
+        return {page_num: self.boxes.rectangles(page_num, self.hits(page_num, leaves)) for page_num in pages if page_num in self.boxes}
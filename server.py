@@ -0,0 +1,220 @@
+import asyncio
+import gc
+import json
+import os
+import signal
+import socket
+from urllib.parse import urlsplit, parse_qs
+from consts import SERVER_HOST, SERVER_PORT, REQUEST_TIMEOUT, RESULTS_PAGE_SIZE, MAX_PAGE_SIZE, WILDCARD_EXPANSIONS
+
+STATUS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    500: "Internal Server Error",
+    504: "Gateway Timeout",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def argument(parameters, name, default=None, type=str):
+    values = parameters.get(name)
+    if not values:
+        if default is None:
+            raise HTTPError(400, f"Missing parameter: {name}")
+        return default
+    try:
+        return type(values[0])
+    except ValueError:
+        raise HTTPError(400, f"Invalid parameter: {name}")
+
+
+# JSON endpoints over a small HTTP/1.1 server. Handlers are plain functions
+# run on the event loop's thread pool, so a slow query only holds up its own
+# request and is answered with 504 once it exceeds the request timeout.
+class SearchService:
+    def __init__(self, search_engine, timeout=REQUEST_TIMEOUT):
+        self.search_engine = search_engine
+        self.timeout = timeout
+        self.routes = {
+            "/search": self.search,
+            "/suggest": self.suggest,
+            "/autocomplete": self.autocomplete,
+            "/stats": self.stats,
+        }
+
+    def search(self, parameters):
+        query = argument(parameters, "q")
+        page = max(argument(parameters, "page", 1, int), 1)
+        size = min(max(argument(parameters, "size", RESULTS_PAGE_SIZE, int), 1), MAX_PAGE_SIZE)
+        missing = []
+        try:
+            entries, more = self.search_engine.results_page(query, page, size, missing=missing)
+        except RuntimeError as e:
+            raise HTTPError(400, str(e))
+        return {
+            "query": query,
+            "page": page,
+            "size": size,
+            "more": more,
+            "missing_shards": missing,
+            "results": [
+                {
+                    "page": page_num,
+                    "label": self.search_engine.page_label(page_num),
+                    "score": score,
+                    "snippet": snippet.text if snippet is not None else None,
+                    "highlights": snippet.highlights if snippet is not None else None,
+                }
+                for page_num, score, snippet in entries
+            ],
+        }
+
+    def suggest(self, parameters):
+        query = argument(parameters, "q")
+        suggestion = self.search_engine.did_you_mean(query)
+        return {"query": query, "suggestion": suggestion if suggestion != query.lower() else None}
+
+    def autocomplete(self, parameters):
+        prefix = argument(parameters, "q").lower()
+        limit = min(max(argument(parameters, "limit", WILDCARD_EXPANSIONS, int), 1), WILDCARD_EXPANSIONS)
+        pattern = prefix if "*" in prefix else prefix + "*"
+        if not pattern.strip("*"):
+            raise HTTPError(400, "Autocomplete needs at least one letter")
+        completions = self.search_engine.expand(pattern, limit)
+        return {"query": prefix, "completions": [{"word": word, "frequency": frequency} for word, frequency in completions]}
+
+    def stats(self, parameters):
+        stats = self.search_engine.profiler.stats()
+        stats["pid"] = os.getpid()
+        stats.update(self.search_engine.stats())
+        return stats
+
+    async def read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    async def respond(self, method, target):
+        if method != "GET":
+            raise HTTPError(405, f"Method {method} is not allowed")
+        url = urlsplit(target)
+        handler = self.routes.get(url.path)
+        if handler is None:
+            raise HTTPError(404, f"No endpoint {url.path}")
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(None, handler, parse_qs(url.query)), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(504, f"Request took longer than {self.timeout}s")
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), self.timeout)
+                except asyncio.TimeoutError:
+                    break
+                except HTTPError as e:
+                    await self.write(writer, e.status, {"error": str(e)}, False)
+                    break
+                if request is None:
+                    break
+                method, target, version, headers = request
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                try:
+                    status, body = 200, await self.respond(method, target)
+                except HTTPError as e:
+                    status, body = e.status, {"error": str(e)}
+                except Exception as e:
+                    status, body = 500, {"error": str(e)}
+                await self.write(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def write(self, writer, status, body, keep_alive):
+        data = json.dumps(body).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+
+    async def serve_socket(self, listener):
+        server = await asyncio.start_server(self.handle, sock=listener)
+        async with server:
+            await server.serve_forever()
+
+
+# Pre-fork model: the index is opened (memory-mapped) once in the parent and
+# the workers inherit it, so every worker reads the same page-cache pages.
+# gc.freeze() keeps the inherited objects out of the collector, which would
+# otherwise touch and copy their pages in every worker.
+def serve(service, host=SERVER_HOST, port=SERVER_PORT, workers=1):
+    listener = socket.create_server((host, port), backlog=128)
+    print(f"Serving on http://{host}:{port} with {workers} worker(s)")
+    if workers <= 1:
+        try:
+            asyncio.run(service.serve_socket(listener))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    # Load the spelling index before forking so the workers share it too.
+    service.search_engine.warm()
+    gc.freeze()
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                asyncio.run(service.serve_socket(listener))
+            finally:
+                os._exit(0)
+        children.append(pid)
+    listener.close()
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
@@ -0,0 +1,388 @@
+import heapq
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from bisect import bisect_right
+from itertools import islice
+from multiprocessing.connection import wait
+from consts import *
+from disk_index import write_index, load_index
+from page_rank import PageRank
+from page_store import PageStore, PageStoreWriter
+from page_text import PageTextStore
+from profiler import Profiler, current
+from snapshots import current_snapshot
+from query import parse_query
+from search_engine import SearchEngine
+from pdf_parser import did_you_mean
+from spelling import SpellingIndex
+from snippets import SpanStore
+
+
+def shard_path(path, shard):
+    return os.path.join(path, f"shard_{shard}")
+
+
+def shards_fresh(count, path=SHARDS_DIR, index_path=None):
+    index_path = index_path or current_snapshot()
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path) as file:
+        if len(json.load(file)["shards"]) != count:
+            return False
+    return os.path.getmtime(manifest_path) >= os.path.getmtime(os.path.join(index_path, TERMS_FILE))
+
+
+def copy_pages(source, path, start, end):
+    store = PageStore(source)
+    try:
+        with PageStoreWriter(path) as writer:
+            for page in store:
+                if start <= page < end:
+                    writer.add(page, store[page])
+    finally:
+        store.close()
+
+
+# Splits the index snapshot at `index_path` (the current one by default) into `count` shards of consecutive pages with
+# about the same number of words each. Every shard is a complete index
+# directory holding only its own pages' postings, text and spans. The
+# manifest records each shard's page range and the collection-wide page
+# count and average page length that shards score with.
+def build_shards(count, path=SHARDS_DIR, index_path=None):
+    index_path = index_path or current_snapshot()
+    index = load_index(index_path)
+    page_lengths = index.page_lengths
+    text = PageStore(os.path.join(index_path, PAGES_FILE))
+    pages = sorted(text.keys())
+    text.close()
+    total = sum(page_lengths.values())
+    bounds = [0]
+    words = 0
+    for page in pages:
+        if len(bounds) < count and page > bounds[-1] and words >= total * len(bounds) / count:
+            bounds.append(page)
+        words += page_lengths.get(page, 0)
+    bounds.append(pages[-1] + 1 if pages else 1)
+
+    shutil.rmtree(path, ignore_errors=True)
+    shards = []
+    for shard, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        directory = shard_path(path, shard)
+        items = ((word, postings.slice(start, end)) for word, postings in index.items())
+        write_index(directory, ((word, postings) for word, postings in items if postings), presorted=True)
+        copy_pages(os.path.join(index_path, PAGES_FILE), os.path.join(directory, PAGES_FILE), start, end)
+        copy_pages(os.path.join(index_path, SPANS_FILE), os.path.join(directory, SPANS_FILE), start, end)
+        shutil.copy(os.path.join(index_path, PAGE_RANK_FILE), os.path.join(directory, PAGE_RANK_FILE))
+        shards.append({"start": start, "end": end})
+    manifest = {
+        "shards": shards,
+        "statistics": {"num_pages": max(len(page_lengths), 1), "average_length": total / max(len(page_lengths), 1) or 1.0},
+    }
+    with open(os.path.join(path, MANIFEST + ".tmp"), "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(os.path.join(path, MANIFEST + ".tmp"), os.path.join(path, MANIFEST))
+    index.close()
+    return manifest
+
+
+# One shard's SearchEngine, answering requests for already parsed queries.
+class ShardWorker:
+    def __init__(self, path, statistics, ranking="bm25"):
+        index = load_index(path)
+        text = PageTextStore(os.path.join(path, PAGES_FILE))
+        spans = SpanStore(os.path.join(path, SPANS_FILE))
+        page_rank = PageRank.load(os.path.join(path, PAGE_RANK_FILE))
+        self.search_engine = SearchEngine(index, text, page_rank, spans, ranking=ranking, report=False, statistics=statistics)
+
+    def plan(self, tree):
+        self.search_engine.validate()
+        return self.search_engine.planner.plan(tree)
+
+    def frequencies(self, tree):
+        plan = self.plan(tree)
+        return {leaf.key(): self.search_engine.planner.execute(leaf).doc_count for leaf in plan.positive_leaves()}
+
+    def search(self, tree, k, frequencies=None):
+        plan = self.plan(tree)
+        if self.search_engine.ranking == "bm25":
+            return self.search_engine.top_k(plan, k, frequencies)
+        rank = self.search_engine.page_rank.rank
+        results = self.search_engine.rank_results(self.search_engine.planner.execute(plan).items())
+        return [(page, (len(positions), rank.get(page, 0))) for page, positions in results[:k]]
+
+    def snippets(self, tree, pages):
+        leaves = list(self.plan(tree).positive_leaves())
+        return {page: self.search_engine.snippet(page, leaves) for page in pages}
+
+
+def serve_shard(path, statistics, ranking, connection):
+    worker = ShardWorker(path, statistics, ranking)
+    while True:
+        try:
+            request = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if request is None:
+            break
+        request_id, operation, arguments = request
+        try:
+            response = (request_id, True, getattr(worker, operation)(**arguments))
+        except Exception as e:
+            response = (request_id, False, f"{type(e).__name__}: {e}")
+        connection.send(response)
+
+
+# Coordinator for shards served by local worker processes over pipes. A
+# query is parsed once and sent to every shard; BM25 first gathers each
+# leaf's document frequency from all shards so every shard scores with the
+# collection-wide idf, then merges the shards' top-k lists. Shards that do
+# not answer within `timeout` seconds, or fail, are left out of the results
+# and reported as missing; a shard whose process died is restarted on the
+# next query. Concurrent queries share the shards: a reader thread hands
+# each answer to the query waiting for its request id, so the lock is only
+# held to send requests and record answers.
+class ShardedSearch:
+    def __init__(self, index, path=SHARDS_DIR, ranking="bm25", timeout=SHARD_TIMEOUT, profile=False, spelling_path=None):
+        with open(os.path.join(path, MANIFEST)) as file:
+            self.manifest = json.load(file)
+        self.trie = index
+        self.spelling_path = spelling_path
+        self.spelling = None
+        self.path = path
+        self.ranking = ranking
+        self.timeout = timeout
+        self.profiler = Profiler(profile)
+        self.starts = [shard["start"] for shard in self.manifest["shards"]]
+        self.context = multiprocessing.get_context("fork")
+        self.lock = threading.Lock()
+        self.answered = threading.Condition(self.lock)
+        self.request_id = 0
+        self.requests = {}
+        self.stale = []
+        self.stopped = False
+        self.wakeup, self.waker = self.context.Pipe(duplex=False)
+        self.processes = [None] * len(self.starts)
+        self.connections = [None] * len(self.starts)
+        self.timeouts = [0] * len(self.starts)
+        self.errors = [0] * len(self.starts)
+        self.restarts = [0] * len(self.starts)
+        for shard in range(len(self.starts)):
+            self.start(shard)
+        self.reader = threading.Thread(target=self.read, name="shard-reader", daemon=True)
+        self.reader.start()
+
+    def page_label(self, page_num):
+        return str(page_num)
+
+    def did_you_mean(self, query):
+        if self.spelling is None:
+            self.spelling = SpellingIndex.load(self.spelling_path)
+        return did_you_mean(query, self.spelling)
+
+    def warm(self):
+        self.did_you_mean("")
+
+    def expand(self, pattern, limit=WILDCARD_EXPANSIONS):
+        return self.trie.expand(pattern, limit)
+
+    # Called with the lock held once the reader runs. The old connection is
+    # closed by the reader, which may still be waiting on it.
+    def start(self, shard):
+        if self.connections[shard] is not None:
+            self.stale.append(self.connections[shard])
+            self.waker.send(None)
+        connection, child = self.context.Pipe()
+        process = self.context.Process(
+            target=serve_shard,
+            args=(shard_path(self.path, shard), self.manifest["statistics"], self.ranking, child),
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        self.processes[shard] = process
+        self.connections[shard] = connection
+
+    def shard(self, page_num):
+        return bisect_right(self.starts, page_num) - 1
+
+    # Sends `arguments[shard]` to each listed shard and waits until all have
+    # answered or the timeout has passed.
+    def scatter(self, operation, arguments, missing):
+        responses = {}
+        with self.lock:
+            self.request_id += 1
+            request_id = self.request_id
+            pending = {}
+            for shard, shard_arguments in arguments.items():
+                if not self.processes[shard].is_alive():
+                    self.restarts[shard] += 1
+                    self.start(shard)
+                try:
+                    self.connections[shard].send((request_id, operation, shard_arguments))
+                    pending[shard] = self.connections[shard]
+                except (BrokenPipeError, OSError):
+                    self.errors[shard] += 1
+            self.requests[request_id] = (pending, responses)
+            deadline = time.monotonic() + self.timeout
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.answered.wait(remaining)
+            del self.requests[request_id]
+            for shard in pending:
+                self.timeouts[shard] += 1
+        for shard in arguments:
+            if shard not in responses and shard not in missing:
+                missing.append(shard)
+        missing.sort()
+        return responses
+
+    # Runs in the reader thread. Answers to requests that already timed out
+    # are dropped; a connection that reaches EOF fails the requests still
+    # waiting on it and is closed, and the shard is restarted by the next
+    # scatter().
+    def read(self):
+        while True:
+            with self.lock:
+                if self.stopped:
+                    return
+                for connection in self.stale:
+                    connection.close()
+                self.stale.clear()
+                connections = {connection: shard for shard, connection in enumerate(self.connections) if not connection.closed}
+            for connection in wait([*connections, self.wakeup]):
+                if connection is self.wakeup:
+                    self.wakeup.recv()
+                    continue
+                shard = connections[connection]
+                try:
+                    response = connection.recv()
+                except (EOFError, OSError):
+                    response = None
+                with self.lock:
+                    if response is None:
+                        self.stale.append(connection)
+                        for pending, _ in self.requests.values():
+                            if pending.get(shard) is connection:
+                                del pending[shard]
+                                self.errors[shard] += 1
+                    else:
+                        response_id, ok, value = response
+                        if response_id in self.requests and shard in self.requests[response_id][0]:
+                            pending, responses = self.requests[response_id]
+                            del pending[shard]
+                            if ok:
+                                responses[shard] = value
+                            else:
+                                self.errors[shard] += 1
+                    self.answered.notify_all()
+
+    def results_page(self, query, page=1, size=RESULTS_PAGE_SIZE, snippets=True, missing=None):
+        missing = [] if missing is None else missing
+        with self.profiler.trace(query) as trace:
+            entries, more = self.gather(query, page, size, snippets, missing)
+            trace.count("missing_shards", len(missing))
+        self.profiler.record(trace)
+        return entries, more
+
+    def gather(self, query, page, size, snippets, missing):
+        trace = current()
+        with trace.stage("parse"):
+            tree = parse_query(query)
+        if tree is None:
+            return [], False
+        shards = range(len(self.starts))
+        frequencies = None
+        if self.ranking == "bm25":
+            with trace.stage("statistics"):
+                responses = self.scatter("frequencies", {shard: {"tree": tree} for shard in shards}, missing)
+            frequencies = {}
+            for shard_frequencies in responses.values():
+                for key, frequency in shard_frequencies.items():
+                    frequencies[key] = frequencies.get(key, 0) + frequency
+
+        end = page * size
+        with trace.stage("search"):
+            responses = self.scatter("search", {shard: {"tree": tree, "k": end + 1, "frequencies": frequencies} for shard in shards}, missing)
+        with trace.stage("merge"):
+            ranked = heapq.merge(*([(page_num, score, shard) for page_num, score in responses[shard]] for shard in sorted(responses)),
+                                 key=lambda result: (result[1], -result[0]), reverse=True)
+            results = list(islice(ranked, end + 1))
+        selected = results[end - size:end]
+
+        found = {}
+        if snippets and selected:
+            requests = {}
+            for page_num, _, shard in selected:
+                requests.setdefault(shard, {"tree": tree, "pages": []})["pages"].append(page_num)
+            with trace.stage("snippets"):
+                for shard_snippets in self.scatter("snippets", requests, missing).values():
+                    found.update(shard_snippets)
+        entries = []
+        for page_num, score, _ in selected:
+            if not isinstance(score, float):
+                score = score[0]
+            entries.append((page_num, score, found.get(page_num) if snippets else None))
+        return entries, len(results) > end
+
+    def search(self, query):
+        page = 1
+        while True:
+            missing = []
+            entries, more = self.results_page(query, page, missing=missing)
+            if missing:
+                print(f"Partial results: shard(s) {', '.join(map(str, missing))} did not answer.\n")
+            if not entries:
+                if page == 1:
+                    print("\033[41m\033[1;37m{}\033[0m".format("No results found!"))
+                return
+            for rank, (page_num, _, snippet) in enumerate(entries, start=(page - 1) * RESULTS_PAGE_SIZE + 1):
+                print(f"{LIGHT_BLUE}Rank: {rank}, Page: {self.page_label(page_num)}{RESET}")
+                print(snippet.highlighted() if snippet is not None else "")
+                print(f"{ORANGE}{'-' * 92}{RESET}")
+            if not more or input("\nSee more (y/n): ").lower() != "y":
+                return
+            print()
+            page += 1
+
+    def stats(self):
+        return {
+            "shards": [
+                {
+                    "start": shard["start"],
+                    "end": shard["end"],
+                    "alive": process.is_alive(),
+                    "timeouts": self.timeouts[i],
+                    "errors": self.errors[i],
+                    "restarts": self.restarts[i],
+                }
+                for i, (shard, process) in enumerate(zip(self.manifest["shards"], self.processes))
+            ]
+        }
+
+    def close(self):
+        with self.lock:
+            self.stopped = True
+            self.waker.send(None)
+        self.reader.join(1)
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+
+    def __str__(self):
+        return "\n".join(
+            f"Shard {i} (pages {shard['start']}-{shard['end'] - 1}): {shard['timeouts']} timeouts, {shard['errors']} errors, {shard['restarts']} restarts"
+            for i, shard in enumerate(self.stats()["shards"])
+        )
@@ -0,0 +1,200 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+from consts import INDEX_DIR, MANIFEST, CURRENT_FILE, SNAPSHOTS_KEPT, RELOAD_INTERVAL
+
+# An index build is published as a snapshot: a directory under INDEX_DIR with
+# every file of the build and a manifest of their sizes and CRC-32s.
+# INDEX_DIR/CURRENT names the live snapshot and is only ever replaced with
+# os.replace, so a reader sees either the old snapshot or the new one. A
+# published snapshot is never rewritten; files added to it later (word boxes)
+# are new files, recorded in its manifest with record_file.
+STAGING_PREFIX = ".building-"
+
+
+def fsync_directory(path):
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def checksum(path):
+    crc = 0
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(1 << 20)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def file_entry(path):
+    with open(path, "rb") as file:
+        os.fsync(file.fileno())
+    return {"size": os.path.getsize(path), "crc32": checksum(path)}
+
+
+def write_json(path, data):
+    with open(path + ".tmp", "w") as file:
+        json.dump(data, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as file:
+        return json.load(file)
+
+
+# A new, empty directory to build a snapshot in. Its name carries the
+# builder's process id, so prune() can tell abandoned builds from running ones.
+def stage(root=INDEX_DIR):
+    os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{STAGING_PREFIX}{os.getpid()}-", dir=root)
+
+
+def publish(staging, root=INDEX_DIR):
+    files = {name: file_entry(os.path.join(staging, name)) for name in sorted(os.listdir(staging))}
+    write_json(os.path.join(staging, MANIFEST), {"created": time.time(), "files": files})
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}"
+    path = os.path.join(root, name)
+    # mkdtemp creates the staging directory private to its owner.
+    os.chmod(staging, 0o755)
+    os.rename(staging, path)
+    with open(os.path.join(root, CURRENT_FILE + ".tmp"), "w") as file:
+        file.write(name + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(os.path.join(root, CURRENT_FILE + ".tmp"), os.path.join(root, CURRENT_FILE))
+    fsync_directory(root)
+    prune(root)
+    return path
+
+
+def current_name(root=INDEX_DIR):
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_snapshot(root=INDEX_DIR):
+    name = current_name(root)
+    if name is None or not os.path.isdir(os.path.join(root, name)):
+        return None
+    return os.path.join(root, name)
+
+
+# Checks every file in the manifest against its recorded size and, unless
+# `checksums` is false, its CRC-32. Raises ValueError naming the first bad file.
+def verify_snapshot(path, checksums=True):
+    manifest = read_manifest(path)
+    for name, entry in manifest["files"].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path):
+            raise ValueError(f"{file_path} is missing from the snapshot.")
+        if os.path.getsize(file_path) != entry["size"]:
+            raise ValueError(f"{file_path} has {os.path.getsize(file_path)} bytes, expected {entry['size']}.")
+        if checksums and checksum(file_path) != entry["crc32"]:
+            raise ValueError(f"{file_path} does not match its checksum.")
+    return manifest
+
+
+def record_file(path, name):
+    manifest = read_manifest(path)
+    manifest["files"][name] = file_entry(os.path.join(path, name))
+    write_json(os.path.join(path, MANIFEST), manifest)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Removes all but the `keep` newest snapshots (the live one is always kept)
+# and staging directories left behind by builds that died.
+def prune(root=INDEX_DIR, keep=SNAPSHOTS_KEPT):
+    live = current_name(root)
+    snapshots = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path):
+            continue
+        if name.startswith(STAGING_PREFIX):
+            pid = name[len(STAGING_PREFIX):].split("-")[0]
+            if pid.isdigit() and not process_alive(int(pid)):
+                shutil.rmtree(path, ignore_errors=True)
+        elif name != live and os.path.exists(os.path.join(path, MANIFEST)):
+            snapshots.append(path)
+    for path in snapshots[:max(len(snapshots) - keep + 1, 0)]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+# Follows CURRENT from a background thread. A newly published snapshot is
+# verified and opened with `open_snapshot` off the query path, then handed
+# over once by take(). The thread is started on first use in each process,
+# so pre-forked server workers each run their own. A snapshot that fails
+# verification is skipped and the current one stays in use.
+class SnapshotWatcher:
+    def __init__(self, path, open_snapshot, interval=RELOAD_INTERVAL):
+        self.root = os.path.dirname(path)
+        self.name = os.path.basename(path)
+        self.open_snapshot = open_snapshot
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.pending = None
+        self.pid = None
+        self.failures = 0
+
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        threading.Thread(target=self.run, name="snapshot-watcher", daemon=True).start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.poll()
+
+    def poll(self):
+        name = current_name(self.root)
+        if name is None or name == self.name:
+            return False
+        path = os.path.join(self.root, name)
+        try:
+            verify_snapshot(path)
+            snapshot = self.open_snapshot(path)
+        except (OSError, ValueError) as e:
+            print(f"Not loading index snapshot {name}: {e}")
+            self.failures += 1
+            self.name = name
+            return False
+        with self.lock:
+            self.pending = (name, snapshot)
+        self.name = name
+        return True
+
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, None
+        return pending
+
+    def close(self):
+        self.stopped.set()
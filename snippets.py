@@ -0,0 +1,103 @@
+import os
+import re
+from array import array
+from consts import SNIPPET_CONTEXT, GREEN, RESET
+from page_store import PageStore, write_page_store
+
+WORD = re.compile(r'\w+')
+
+
+def word_spans(text):
+    # Start and end offsets of every word, in the order split_words() yields
+    # them, so word position p covers text[spans[2 * p]:spans[2 * p + 1]].
+    spans = array("I")
+    for match in WORD.finditer(text):
+        spans.append(match.start())
+        spans.append(match.end())
+    return spans
+
+
+def write_spans(path, spans):
+    write_page_store(path, ((page, page_spans.tobytes()) for page, page_spans in spans.items()))
+
+
+def load_spans(path, text):
+    if not os.path.exists(path):
+        write_spans(path, {page: word_spans(page_text) for page, page_text in text.items()})
+    return SpanStore(path)
+
+
+class SpanStore:
+    def __init__(self, path):
+        self.store = PageStore(path)
+
+    def close(self):
+        self.store.close()
+
+    def __contains__(self, page):
+        return page in self.store
+
+    def __getitem__(self, page):
+        return array("I", self.store[page])
+
+
+class Snippet:
+    def __init__(self, text, highlights):
+        self.text = text
+        self.highlights = highlights
+
+    def __len__(self):
+        return len(self.text)
+
+    def __bool__(self):
+        return bool(self.text)
+
+    def highlighted(self, before=GREEN, after=RESET):
+        parts = []
+        last = 0
+        for start, end in self.highlights:
+            parts.append(self.text[last:start])
+            parts.append(before + self.text[start:end] + after)
+            last = end
+        parts.append(self.text[last:])
+        return "".join(parts)
+
+    def __str__(self):
+        return self.highlighted()
+
+
+# hits are (first word position, number of words) pairs. Overlapping hits are
+# highlighted as one, each is widened by `context` characters on both sides
+# and overlapping windows are merged before being joined.
+def make_snippet(text, spans, hits, context=SNIPPET_CONTEXT, separator=" ... "):
+    matches = []
+    for position, length in sorted(set(hits)):
+        last = position + length - 1
+        if 2 * last + 1 >= len(spans):
+            continue
+        start, end = spans[2 * position], spans[2 * last + 1]
+        if matches and start <= matches[-1][1]:
+            matches[-1][1] = max(matches[-1][1], end)
+        else:
+            matches.append([start, end])
+    windows = []
+    for start, end in matches:
+        window_start = max(0, start - context)
+        window_end = min(len(text), end + context)
+        if windows and window_start <= windows[-1][1]:
+            windows[-1][1] = window_end
+            windows[-1][2].append((start, end))
+        else:
+            windows.append([window_start, window_end, [(start, end)]])
+
+    parts = []
+    highlights = []
+    length = 0
+    for window_start, window_end, window_matches in windows:
+        if parts:
+            length += len(separator)
+        for start, end in window_matches:
+            highlights.append((length + start - window_start, length + end - window_start))
+        parts.append(text[window_start:window_end])
+        length += window_end - window_start
+    return Snippet(separator.join(parts), highlights)
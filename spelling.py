@@ -0,0 +1,85 @@
+import Levenshtein
+from trie import serialize, deserialize
+
+
+# Symmetric-delete spelling correction: every dictionary word is indexed by all
+# strings reachable from its first `prefix_length` characters with up to
+# `max_distance` deletions. A lookup generates the deletions of the typed word
+# and only compares it against the words that share one of them.
+class SpellingIndex:
+    def __init__(self, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words = []
+        self.frequencies = []
+        self.word_ids = {}
+        self.deletes = {}
+
+    @classmethod
+    def build(cls, word_frequencies, max_distance=2, prefix_length=7):
+        index = cls(max_distance, prefix_length)
+        for word, frequency in word_frequencies:
+            index.add(word, frequency)
+        return index
+
+    def add(self, word, frequency=1):
+        if word in self.word_ids:
+            self.frequencies[self.word_ids[word]] += frequency
+            return
+        word_id = len(self.words)
+        self.words.append(word)
+        self.frequencies.append(frequency)
+        self.word_ids[word] = word_id
+        for delete in self._deletes(word[:self.prefix_length]):
+            self.deletes.setdefault(delete, []).append(word_id)
+
+    def _deletes(self, word):
+        deletes = {word}
+        edits = [word]
+        for _ in range(self.max_distance):
+            next_edits = []
+            for edit in edits:
+                for i in range(len(edit)):
+                    delete = edit[:i] + edit[i + 1:]
+                    if delete not in deletes:
+                        deletes.add(delete)
+                        next_edits.append(delete)
+            edits = next_edits
+        return deletes
+
+    def suggestions(self, typed_word):
+        if typed_word in self.word_ids:
+            return [(typed_word, 0, self.frequencies[self.word_ids[typed_word]])]
+        checked = set()
+        suggestions = []
+        for delete in self._deletes(typed_word[:self.prefix_length]):
+            for word_id in self.deletes.get(delete, ()):
+                if word_id in checked:
+                    continue
+                checked.add(word_id)
+                word = self.words[word_id]
+                if abs(len(word) - len(typed_word)) > self.max_distance:
+                    continue
+                distance = Levenshtein.distance(typed_word, word)
+                if distance <= self.max_distance:
+                    suggestions.append((word, distance, self.frequencies[word_id]))
+        suggestions.sort(key=lambda suggestion: (suggestion[1], -suggestion[2], suggestion[0]))
+        return suggestions
+
+    def correct(self, typed_word):
+        suggestions = self.suggestions(typed_word)
+        if not suggestions:
+            return typed_word
+        return suggestions[0][0]
+
+    def __len__(self):
+        return len(self.words)
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(serialize(self))
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as file:
+            return deserialize(file.read())
@@ -0,0 +1,89 @@
+import random
+from itertools import product
+import pytest
+from postings import PostingList, phrase_intersect, near_intersect, union_all
+
+
+# Random posting lists as {doc: sorted positions}, spread over enough pages
+# to span several blocks.
+def random_postings(rng, pages=400, density=0.3, positions=12):
+    return {doc: sorted(rng.sample(range(40), rng.randint(1, positions))) for doc in range(pages) if rng.random() < density}
+
+
+def build(postings):
+    return PostingList.from_items(sorted(postings.items()))
+
+
+def as_dict(postings):
+    return dict(postings.items())
+
+
+@pytest.fixture(params=range(10))
+def rng(request):
+    return random.Random(request.param)
+
+
+def test_intersect(rng):
+    left, right = random_postings(rng), random_postings(rng)
+    expected = {doc: sorted(set(left[doc]) | set(right[doc])) for doc in left.keys() & right.keys()}
+    assert as_dict(build(left).intersect(build(right))) == expected
+
+
+def test_union(rng):
+    left, right = random_postings(rng), random_postings(rng)
+    expected = {doc: sorted(set(left.get(doc, [])) | set(right.get(doc, []))) for doc in left.keys() | right.keys()}
+    assert as_dict(build(left).union(build(right))) == expected
+    assert as_dict(union_all([build(left), build(right)])) == expected
+
+
+def test_union_all(rng):
+    lists = [random_postings(rng, density=0.1) for _ in range(5)]
+    expected = {}
+    for postings in lists:
+        for doc, positions in postings.items():
+            expected[doc] = sorted(set(expected.get(doc, [])) | set(positions))
+    assert as_dict(union_all([build(postings) for postings in lists])) == expected
+
+
+def test_difference(rng):
+    left, right = random_postings(rng), random_postings(rng)
+    expected = {doc: positions for doc, positions in left.items() if doc not in right}
+    assert as_dict(build(left).difference(build(right))) == expected
+
+
+def test_phrase_intersect(rng):
+    lists = [random_postings(rng, density=0.6, positions=20) for _ in range(3)]
+    expected = {}
+    for doc in lists[0].keys() & lists[1].keys() & lists[2].keys():
+        starts = [start for start in lists[0][doc] if all(start + i in lists[i][doc] for i in range(1, 3))]
+        if starts:
+            expected[doc] = starts
+    assert as_dict(phrase_intersect([build(postings) for postings in lists])) == expected
+
+
+# The span of the tightest window with one match from every list; in order,
+# each match starts at least `lengths` of the previous one after it.
+def tightest_span(position_lists, ordered, lengths):
+    spans = []
+    for chosen in product(*position_lists):
+        if ordered and any(chosen[i] < chosen[i - 1] + lengths[i - 1] for i in range(1, len(chosen))):
+            continue
+        spans.append(max(chosen) - min(chosen))
+    return min(spans, default=None)
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_near_intersect(rng, ordered):
+    lists = [random_postings(rng, density=0.6, positions=5) for _ in range(3)]
+    lengths = [rng.randint(1, 2) for _ in lists]
+    distance = rng.randint(2, 10)
+    expected = {}
+    for doc in lists[0].keys() & lists[1].keys() & lists[2].keys():
+        span = tightest_span([postings[doc] for postings in lists], ordered, lengths)
+        if span is not None and span <= distance:
+            expected[doc] = span
+    result = as_dict(near_intersect([build(postings) for postings in lists], distance, ordered, lengths))
+    assert {doc: window[-1] - window[0] for doc, window in result.items()} == expected
+    if ordered:
+        for doc, window in result.items():
+            assert all(window[i] in lists[i][doc] for i in range(len(lists)))
@@ -0,0 +1,48 @@
+import random
+from types import SimpleNamespace
+import pytest
+from postings import PostingList
+from scoring import BM25
+from test_postings import random_postings, build
+
+
+# Every page's score computed directly, ranked like top_k: by score, then
+# by page number.
+def brute_force_top_k(scorer, term_postings, k, candidates=None, proximity=(), frequencies=None, covered=True):
+    pages = set()
+    for postings in term_postings:
+        pages.update(postings)
+    if candidates is not None:
+        pages = set(candidates) if not covered else pages & set(candidates)
+    results = []
+    for page in pages:
+        score = scorer.prior(page)
+        for postings in proximity:
+            if page in postings:
+                score += scorer.proximity_weight / (1 + postings[page][-1] - postings[page][0])
+        for i, postings in enumerate(term_postings):
+            if page in postings:
+                score += scorer.term_score(len(postings[page]), page, scorer.idf(frequencies[i] if frequencies else len(postings)))
+        results.append((page, score))
+    results.sort(key=lambda result: (-result[1], result[0]))
+    return results[:k]
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("k", [1, 10, 1000])
+def test_top_k_matches_brute_force(seed, k):
+    rng = random.Random(seed)
+    page_lengths = {page: rng.randint(20, 400) for page in range(400)}
+    page_rank = SimpleNamespace(rank={page: rng.random() / 400 for page in page_lengths})
+    scorer = BM25(page_lengths, page_rank)
+    terms = [random_postings(rng, density=rng.choice([0.02, 0.2, 0.6])) for _ in range(rng.randint(1, 4))]
+    candidates = random_postings(rng, density=0.5) if seed % 2 else None
+    proximity = [random_postings(rng, density=0.1)] if seed % 3 == 0 else []
+    frequencies = [len(postings) + rng.randint(0, 50) for postings in terms] if seed % 4 == 0 else None
+    covered = candidates is None or seed % 5 != 0
+
+    results = scorer.top_k([build(postings) for postings in terms], k, build(candidates) if candidates is not None else None,
+                           [build(postings) for postings in proximity], frequencies, covered)
+    expected = brute_force_top_k(scorer, terms, k, candidates, proximity, frequencies, covered)
+    assert [page for page, _ in results] == [page for page, _ in expected]
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected])
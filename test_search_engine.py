@@ -0,0 +1,39 @@
+import os
+import pytest
+from consts import PAGES_FILE, SPANS_FILE, PAGE_RANK_FILE
+from disk_index import load_index
+from page_rank import PageRank
+from page_text import PageTextStore
+from query import parse_query
+from search_engine import SearchEngine
+from snippets import SpanStore
+from test_shards import write_test_index
+
+
+@pytest.fixture
+def search_engine(tmp_path):
+    path = str(tmp_path)
+    write_test_index(path)
+    index = load_index(path)
+    engine = SearchEngine(index, PageTextStore(os.path.join(path, PAGES_FILE)), PageRank.load(os.path.join(path, PAGE_RANK_FILE)),
+                          SpanStore(os.path.join(path, SPANS_FILE)), report=False)
+    yield engine
+    index.close()
+
+
+@pytest.mark.parametrize("query", [
+    "heap",
+    "heap AND key",
+    "heap OR tree",
+    "heap OR NOT binary",
+    "NOT heap",
+    "(heap OR NOT top) AND keeps",
+    "binary NEAR/2 heap OR NOT key",
+    "zzzz AND heap",
+])
+def test_top_k_returns_every_match(search_engine, query):
+    plan = search_engine.planner.plan(parse_query(query))
+    expected = search_engine.planner.execute(plan).doc_count
+    search_engine.cache.clear()
+    plan = search_engine.planner.plan(parse_query(query))
+    assert len(search_engine.top_k(plan, 1000)) == expected
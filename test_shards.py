@@ -0,0 +1,56 @@
+import os
+import time
+from collections import defaultdict
+from consts import PAGES_FILE, SPANS_FILE, PAGE_RANK_FILE
+from disk_index import write_index, load_index
+from page_rank import PageRank
+from page_text import write_page_text
+from server import SearchService
+from shards import ShardWorker, ShardedSearch, build_shards
+from snippets import WORD, word_spans, write_spans
+
+PAGES = {
+    0: "a binary heap keeps the smallest key on top",
+    1: "heap sort builds a heap and removes the top key",
+    2: "a binary search tree keeps keys in order",
+    3: "heap ordered trees and the heap property",
+    4: "graphs have vertices joined by edges",
+}
+
+
+def write_test_index(path):
+    postings = defaultdict(list)
+    for page, text in PAGES.items():
+        for position, match in enumerate(WORD.finditer(text)):
+            postings[match.group().lower()].append((page, position))
+    write_index(path, postings.items())
+    write_page_text(os.path.join(path, PAGES_FILE), PAGES)
+    write_spans(os.path.join(path, SPANS_FILE), {page: word_spans(text) for page, text in PAGES.items()})
+    page_rank = PageRank()
+    page_rank.calculate_page_rank(PAGES.keys())
+    page_rank.save(os.path.join(path, PAGE_RANK_FILE))
+
+
+def test_snippet_timeout_gives_partial_results(tmp_path, monkeypatch):
+    index_path = str(tmp_path / "index")
+    shards_path = str(tmp_path / "shards")
+    write_test_index(index_path)
+    build_shards(2, shards_path, index_path)
+
+    # Shards are forked after the patch, so every shard misses the snippet deadline.
+    def slow_snippets(self, tree, pages):
+        time.sleep(1)
+        return {}
+
+    monkeypatch.setattr(ShardWorker, "snippets", slow_snippets)
+    index = load_index(index_path)
+    search = ShardedSearch(index, shards_path, timeout=0.2)
+    try:
+        response = SearchService(search).search({"q": ["heap"]})
+    finally:
+        search.close()
+        index.close()
+
+    assert [result["page"] for result in response["results"]] == [3, 1, 0]
+    assert all(result["snippet"] is None and result["highlights"] is None for result in response["results"])
+    assert response["missing_shards"] == [0, 1]
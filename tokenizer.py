@@ -1,5 +1,4 @@
 import re
-from consts import calculate_priority
 
 
 class Token:
@@ -20,6 +19,10 @@ class Tokenizer:
             ('AND',    r'\bAND\b'),   # AND operator
             ('OR',     r'\bOR\b'),    # OR operator
             ('NOT',    r'\bNOT\b'),   # NOT operator
+            ('NEAR',   r'\bNEAR/\d+\b'),   # Unordered proximity operator
+            ('ONEAR',  r'\bONEAR/\d+\b'),  # Ordered proximity operator
+            ('LPAREN', r'\('),        # Opening parenthesis
+            ('RPAREN', r'\)'),        # Closing parenthesis
             ('TERM',   r'[^\s()]+'),  # Term (any non-whitespace, non-parenthesis sequence)
             ('SKIP',   r'\s+'),       # Skip over spaces and tabs
             ('PREFIX', r'\*'),        # Prefix operator
@@ -39,45 +42,13 @@ class Tokenizer:
                 raise RuntimeError(f'Unexpected character: {value}')
             else:
                 current_token = Token(kind, value)
-                if previous_token and previous_token.type in ('AND', 'OR', 'NOT') and current_token.type in ('AND', 'OR', 'NOT'):
+                if previous_token and previous_token.type in ('AND', 'OR', 'NOT', 'NEAR', 'ONEAR') and current_token.type in ('AND', 'OR', 'NEAR', 'ONEAR'):
                     raise RuntimeError(f'Missing term between operators: {previous_token.value} and {current_token.value}')
-                
-                if current_token.type == 'PHRASE':
-                    phrase_terms = value.strip('"').split()
-                    for i, term in enumerate(phrase_terms):
-                        self.tokens.append(Token('PHRASE', term))
-                        if i < len(phrase_terms) - 1:
-                            self.tokens.append(Token('AND', 'AND'))
-                else:
-                    if previous_token and previous_token.type == 'TERM' and current_token.type == 'TERM':
-                        self.tokens.append(Token('OR', 'OR'))
-                    self.tokens.append(current_token)
-                
-                previous_token = current_token
-        
-        return self.divide()
 
-    def divide(self):
-        terms = []
-        string = ""
-        current_terms = []
-        for token in self.tokens:
-            if token.type == 'TERM' or token.type == 'PHRASE':
-                term = token.value.lower()
-                if term.endswith('*'):
-                    term = term[:-1]
-                    terms.append((term, 'PREFIX'))
-                elif token.type == 'PHRASE':
-                    terms.append((term, 'PHRASE'))
-                else:
-                    terms.append((term, []))
+                if previous_token and previous_token.type in ('TERM', 'PHRASE', 'RPAREN') and current_token.type in ('TERM', 'PHRASE', 'LPAREN'):
+                    self.tokens.append(Token('OR', 'OR'))
+                self.tokens.append(current_token)
 
-            else:
-                if current_terms:
-                    terms.append((' '.join(current_terms), []))
-                    current_terms = []
-                priority = str(calculate_priority(token.type))
-                string += priority
-        if current_terms:
-            terms.append((' '.join(current_terms), []))
-        return terms, string
\ No newline at end of file
+                previous_token = current_token
+
+        return self.tokens
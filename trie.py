@@ -1,6 +1,8 @@
 import pickle
 
 
+# TrieNode and Trie are the format of the pickled `library` file written by
+# older versions; they are kept so that file can still be converted.
 class TrieNode:
     def __init__(self):
         self.children = {}
@@ -12,6 +14,9 @@ class Trie:
         self.root = TrieNode()
 
     def insert(self, word, page_num, position):
+        self.extend(word, [(page_num, position)])
+
+    def extend(self, word, postings):
         node = self.root
         for char in word:
             if char not in node.children:
@@ -19,7 +24,7 @@ class Trie:
             node = node.children[char]
         if "positions" not in node.children:
             node.children["positions"] = []
-        node.children["positions"].append((page_num, position))
+        node.children["positions"].extend(postings)
         node.is_end_of_word = True
 
     def search(self, word):
@@ -48,6 +53,9 @@ class Trie:
             if char != "positions":
                 self._dfs(next_node, prefix + char, words_with_positions)
 
+    def items(self):
+        return self.starts_with("")
+
 def serialize(data):
     return pickle.dumps(data)
 